@@ -1,23 +1,107 @@
-from flask import Flask, request, redirect, url_for, flash, jsonify, Response, session
+from flask import Flask, request, redirect, url_for, flash, jsonify, Response, session, send_file, abort, stream_with_context
 from flask_login import LoginManager, login_user, current_user, login_required, logout_user, UserMixin, AnonymousUserMixin
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_migrate import Migrate
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.http import http_date
 from datetime import datetime, timedelta
 
+import click
+import csv
+import functools
+import gzip
+import io
 import json
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # Optional; responses fall back to gzip.
+    brotli = None
+
+import dbconfig
+import imagestore
+from cache import CatalogCache
+from metrics import RequestMetrics
+from offers import ExpiryScheduler
+from passwords import Busy, PasswordHasher
+from profiles import Profile, ProfileCache
+from pubsub import Hub
+from routing import ReplicaRouter, RoutingSession
+from search import ProductSearch, Suggester
+from serializers import Field, Schema, dumps, json_response
 
 app = Flask(__name__)
-cors = CORS(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+cors = CORS(app, expose_headers=['X-Next-After', 'X-Next-Offset', 'X-Next-Before', 'X-Next-Before-Id'])
+# Engine and SQLite tuning come from the environment; see dbconfig.py.
+app.config['SQLALCHEMY_DATABASE_URI'] = dbconfig.database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dbconfig.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+# Unset: all queries go to the primary. Set: catalog reads go to this bind.
+app.config['DATABASE_REPLICA_URL'] = dbconfig.database_url('DATABASE_REPLICA_URL', default=None)
+# After a seller writes, their reads stay on the primary this long.
+app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+if app.config['DATABASE_REPLICA_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': dict(
+        url=app.config['DATABASE_REPLICA_URL'],
+        **dbconfig.engine_options(app.config['DATABASE_REPLICA_URL']))}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'Software-Samurai'
-
-db = SQLAlchemy(app)
+app.config['IMAGE_STORE'] = os.path.join(app.instance_path, 'images')
+app.config['IMAGE_WORKERS'] = 2
+app.config['MAX_IMAGE_BYTES'] = int(os.environ.get('MAX_IMAGE_BYTES', 5 * 1024 * 1024))
+# Unset: chat pushes stay in-process. redis://...: shared across workers.
+app.config['CHAT_PUBSUB_URL'] = os.environ.get('CHAT_PUBSUB_URL')
+app.config['CHAT_KEEPALIVE_SECONDS'] = 15
+# Unset: per-process LRU. redis://...: shared by all workers.
+app.config['CATALOG_CACHE_URL'] = os.environ.get('CATALOG_CACHE_URL')
+app.config['CATALOG_CACHE_TTL'] = 60
+app.config['CATALOG_CACHE_MAX_BYTES'] = 64 * 1024 * 1024
+# Any Werkzeug method (scrypt:n:r:p, pbkdf2:sha256:iterations) or
+# argon2:time_cost:memory_cost:parallelism. Older hashes are upgraded on login.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+# Processes hashing passwords; 0 hashes on the request thread.
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+# Hashes queued or running before register/login answer 503.
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+# User profiles (load_user, /usernew, chat names) are cached per process.
+app.config['USER_CACHE_TTL'] = 60
+app.config['USER_CACHE_MAX_ENTRIES'] = 10000
+# How often the offer scheduler rereads upcoming expirations from the database.
+app.config['OFFER_EXPIRY_REFRESH_SECONDS'] = 300
+# Log SQL statements slower than this many ms, with their parameters, on the
+# 'sql.slow' logger. Unset: off.
+app.config['SLOW_QUERY_MS'] = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+# How often the in-memory search index and suggestions check for products
+# written by other workers.
+app.config['SEARCH_REFRESH_SECONDS'] = float(os.environ.get('SEARCH_REFRESH_SECONDS', 30))
+# JSON bodies smaller than this are sent uncompressed.
+app.config['COMPRESS_MIN_SIZE'] = 1024
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+with app.app_context():
+    for engine in db.engines.values():
+        dbconfig.install(engine)
+# Registered before the other request hooks so its after_request runs last
+# and sees the final (compressed) response.
+request_metrics = RequestMetrics(app, slow_query_ms=app.config['SLOW_QUERY_MS'])
 migrate = Migrate(app, db)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+chat_hub = Hub.from_url(app.config['CHAT_PUBSUB_URL'])
+catalog_cache = CatalogCache.from_url(
+    app.config['CATALOG_CACHE_URL'], ttl=app.config['CATALOG_CACHE_TTL'],
+    max_bytes=app.config['CATALOG_CACHE_MAX_BYTES'])
+image_variants = imagestore.VariantPipeline(
+    app.config['IMAGE_STORE'], max_workers=app.config['IMAGE_WORKERS'])
+password_hasher = PasswordHasher(
+    app.config['PASSWORD_HASH_METHOD'], max_workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_MAX_PENDING'])
 
 #fsd
 
@@ -27,7 +111,8 @@ class Usernew(db.Model, UserMixin):
     lastname = db.Column(db.String(80), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     mobile = db.Column(db.String(20), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
+    # scrypt and argon2 hashes are longer than 120 characters.
+    password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(120))
     premium = db.Column(db.Boolean, default=False)
 
@@ -49,6 +134,19 @@ class Product(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey(
         'usernew.id'))  # New foreign key column
     image = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Copy of the seller's Usernew.premium so listings need no join; kept in
+    # sync by sync_seller_premium and checked by `flask check-seller-premium`.
+    seller_premium = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    __table_args__ = (
+        db.Index('ix_product_category', 'category'),
+        db.Index('ix_product_updated_at', 'updated_at'),
+        # /offers/active; id order within each value comes with the rowid/PK.
+        db.Index('ix_product_has_discount', 'hasDiscount'),
+        # Also serves lookups by user_id alone (leftmost column).
+        db.Index('uq_product_user_id_name', 'user_id', 'name', unique=True),
+    )
 
     def __init__(self, name, category, description, user_id, price=0.0, count=0, discounted_price=0.0, offer_price=None, offer_expiration=None):
         self.name = name
@@ -75,6 +173,7 @@ class Order(db.Model):
     city = db.Column(db.String(100), nullable=False)
     state = db.Column(db.String(100), nullable=False)
     pincode = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     items = db.relationship('OrderItem', backref='order', lazy=True)
 
 
@@ -82,7 +181,7 @@ class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_name = db.Column(db.String(100), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
 
 
 class ChatMessage(db.Model):
@@ -91,11 +190,394 @@ class ChatMessage(db.Model):
     receiver_id = db.Column(db.Integer, nullable=False)
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    read_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_chat_message_sender_receiver_timestamp',
+                 'sender_id', 'receiver_id', 'timestamp'),
+        db.Index('ix_chat_message_receiver_id', 'receiver_id'),
+    )
+
+
+def image_url(image):
+    if not image:
+        return None
+    if not imagestore.is_digest(image):
+        # Row written before images moved to the blob store.
+        return image
+    return url_for('get_image', digest=image, _external=True)
+
+
+def image_srcset(image):
+    """Advertises the responsive variants as srcset strings per format."""
+    if not imagestore.is_digest(image) or not image_variants.enabled:
+        return None
+    return {
+        fmt: ', '.join('{} {}w'.format(
+            url_for('get_image_variant', digest=image, width=width, fmt=fmt,
+                    _external=True), width)
+            for width in imagestore.VARIANT_WIDTHS)
+        for fmt in imagestore.VARIANT_FORMATS
+    }
+
+
+# Response keys of the product listings and the column each comes from.
+# `fields=` lets list views ask for a subset (e.g. leave out `image`).
+product_schema = Schema(
+    Field('id', Product.id),
+    Field('name', Product.name),
+    Field('category', Product.category),
+    Field('description', Product.description),
+    Field('count', Product.count),
+    Field('price', Product.price),
+    Field('discounted_price', Product.discounted_price),
+    Field('offer_valid_till', Product.offer_expiration),
+    Field('is_premium_seller', Product.seller_premium),
+    Field('image', Product.image, image_url),
+    Field('image_srcset', Product.image, image_srcset),
+    Field('premium_seller', Product.seller_premium),
+    # ISO with microseconds: clients pass it back as the export's ?since=.
+    Field('updated_at', Product.updated_at, lambda value: value and value.isoformat())
+)
+SUMMARY_FIELDS = ['name', 'count', 'price', 'discounted_price']
+MAX_PAGE_SIZE = 500
+
+
+def requested_fields(default):
+    fields = request.values.get('fields')
+    if not fields:
+        return default
+    selected = [f for f in fields.split(',') if f in product_schema]
+    return selected or default
+
+
+def catalog_query(fields=None):
+    fields = fields or product_schema.keys()
+    # Product.id is always selected last: it is the pagination cursor.
+    return db.session.query(*product_schema.columns(fields),
+                            Product.id.label('cursor_id'))
+
+
+def paginate(query):
+    """Keyset pagination on Product.id driven by ?after= and ?limit=.
+
+    Returns the rows and the cursor for the next page (None on the last
+    page). Without ?limit= the whole result is returned, as before.
+    """
+    after = request.values.get('after', type=int)
+    limit = request.values.get('limit', type=int)
+    if after is not None:
+        query = query.filter(Product.id > after)
+    query = query.order_by(Product.id)
+    if limit is None:
+        return query.all(), None
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].cursor_id
+    return rows, None
+
+
+def page_response(rows, fields, next_after):
+    headers = {'X-Next-After': str(next_after)} if next_after is not None else None
+    return json_response(product_schema.dump(rows, fields), headers=headers)
+
+
+product_search = ProductSearch(Product, refresh=app.config['SEARCH_REFRESH_SECONDS'])
+product_search.attach(db.session)
+product_suggester = Suggester(Product.__table__.name, refresh=app.config['SEARCH_REFRESH_SECONDS'])
+product_search.listeners.append(product_suggester)
+
+
+def client_key():
+    """The seller a request acts for, as the frontend sends it (userId)."""
+    key = request.values.get('userId')
+    if key is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            key = data.get('userId')
+    return key
+
+
+replica_router = ReplicaRouter(enabled=bool(app.config['DATABASE_REPLICA_URL']),
+                               window=app.config['REPLICA_STICKY_SECONDS'],
+                               client_key=client_key,
+                               # Only catalog writes can make a replica read stale.
+                               tables=(Product.__table__.name, Usernew.__table__.name))
+replica_router.attach(db.session)
+
+
+def product_tags(product_id, category):
+    """Cache tags touched by a write to one product."""
+    return {'catalog', 'category:{}'.format(category), 'product:{}'.format(product_id)}
+
+
+@event.listens_for(db.session, 'before_flush')
+def default_seller_premium(session, flush_context, instances):
+    """Fills seller_premium on new products that were not given one."""
+    products = [obj for obj in session.new
+                if isinstance(obj, Product) and obj.seller_premium is None and obj.user_id is not None]
+    if products:
+        premium = dict(session.execute(db.select(Usernew.id, Usernew.premium).where(
+            Usernew.id.in_({product.user_id for product in products}))).all())
+        for product in products:
+            product.seller_premium = bool(premium.get(product.user_id))
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_seller_premium(session, flush_context):
+    """Copies a changed Usernew.premium onto Product.seller_premium.
+
+    Runs inside the flush, so the copy commits or rolls back with the
+    change; the seller's listings are invalidated once it commits.
+    """
+    table = Product.__table__
+    for user in session.dirty:
+        if not isinstance(user, Usernew) or not inspect(user).attrs.premium.history.has_changes():
+            continue
+        premium = bool(user.premium)
+        connection = session.connection()
+        products = connection.execute(db.select(table.c.id, table.c.category).where(
+            table.c.user_id == user.id)).all()
+        connection.execute(table.update().where(table.c.user_id == user.id).values(
+            seller_premium=premium))
+        tags = session.info.setdefault('premium_tags', set())
+        for product in products:
+            tags.update(product_tags(product.id, product.category))
+        for obj in session.identity_map.values():
+            if isinstance(obj, Product) and obj.user_id == user.id:
+                set_committed_value(obj, 'seller_premium', premium)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_seller_premium(session):
+    tags = session.info.pop('premium_tags', None)
+    if tags:
+        catalog_cache.invalidate(tags)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_seller_premium(session):
+    session.info.pop('premium_tags', None)
+
+
+def load_offer_expirations(until):
+    with app.app_context():
+        return db.session.query(Product.id, Product.offer_expiration).filter(
+            Product.hasDiscount == db.true(), Product.offer_expiration <= until).all()
+
+
+def expire_offers(ids, now):
+    """Ends the offers of ``ids`` that are still due, in one UPDATE."""
+    with app.app_context():
+        table = Product.__table__
+        due = db.and_(table.c.id.in_(ids), table.c.hasDiscount == db.true(),
+                      table.c.offer_expiration <= now)
+        products = db.session.execute(db.select(table.c.id, table.c.category).where(due)).all()
+        if not products:
+            return 0
+        # Same state as add_product() leaves a product without an offer.
+        db.session.execute(table.update().where(due).values(
+            hasDiscount=False, discounted_price=0, offer_price=None, offer_expiration=None))
+        db.session.commit()
+        tags = set()
+        for product in products:
+            tags.update(product_tags(product.id, product.category))
+        catalog_cache.invalidate(tags)
+        return len(products)
+
+
+offer_expiry = ExpiryScheduler(load_offer_expirations, expire_offers,
+                               refresh=app.config['OFFER_EXPIRY_REFRESH_SECONDS'])
+
+
+@app.before_request
+def start_offer_expiry():
+    offer_expiry.start()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_offer_expirations(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Product) and obj.hasDiscount and obj.offer_expiration is not None:
+            session.info.setdefault('offer_expirations', []).append((obj.id, obj.offer_expiration))
+
+
+@event.listens_for(db.session, 'after_commit')
+def schedule_offer_expirations(session):
+    for product_id, expires_at in session.info.pop('offer_expirations', ()):
+        offer_expiry.schedule(product_id, expires_at)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_offer_expirations(session):
+    session.info.pop('offer_expirations', None)
+
+
+def cached_response(tags):
+    """Serves GET requests of a view from the catalog cache.
+
+    The key is the full URL, so category, search, page and fields all
+    select their own entry. ``tags`` receives the view arguments and
+    returns the tags the writes in add_product, editproduct and
+    place_order invalidate.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            key = '{}{}?{}'.format(request.host, request.path,
+                                   '&'.join(sorted(request.query_string.decode().split('&'))))
+            hit = catalog_cache.get(key)
+            if hit is not None:
+                body, headers = hit
+                return Response(body, mimetype='application/json', headers=headers)
+            # Read before the view: a write committed while it runs bumps the
+            # version and the possibly stale body is not stored.
+            version = catalog_cache.version()
+            response = app.make_response(view(*args, **kwargs))
+            # A lagging replica could fill the cache with rows a write just replaced.
+            if response.status_code == 200 and response.is_json and not replica_router.stale():
+                headers = {name: value for name, value in response.headers.items()
+                           if name.startswith('X-Next-')}
+                catalog_cache.set(key, response.get_data(), headers, tags(*args, **kwargs),
+                                  version=version)
+            return response
+        return wrapper
+    return decorator
+
+
+def catalog_etag(view):
+    """Answers If-None-Match on catalog GETs from the catalog version alone.
+
+    The version is bumped by every catalog write, so a matching weak ETag
+    means nothing changed and the view (and its query) is skipped. Without
+    Redis other workers' writes are not seen, so tags lapse after
+    CATALOG_CACHE_TTL like cached pages do.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET':
+            return view(*args, **kwargs)
+        etag = 'catalog-' + catalog_cache.etag_version()
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if replica_router.stale():
+                # The body may predate the version; let the content ETag stand.
+                return response
+        response.set_etag(etag, weak=True)
+        return response
+    return wrapper
+
+
+@app.after_request
+def finish_json_response(response):
+    """Conditional GET and compression for JSON responses."""
+    if not response.is_json or response.direct_passthrough or response.is_streamed:
+        return response
+    if request.method == 'GET' and response.status_code == 200:
+        if 'ETag' not in response.headers:
+            response.add_etag(weak=True)
+        response.make_conditional(request)
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encodings = request.accept_encodings
+    if brotli is not None and encodings['br']:
+        encoding = 'br'
+    elif encodings['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+    response.set_data(compress_body(body, encoding, response.headers.get('ETag')))
+    response.content_encoding = encoding
+    return response
+
+
+# Compressed bodies of recent responses that carry an ETag, so a large
+# cached listing is compressed once per catalog version, not per request.
+compressed_bodies = OrderedDict()
+compressed_bodies_lock = threading.Lock()
+
+
+def compress_body(body, encoding, etag):
+    key = (request.url, etag, encoding) if etag else None
+    if key is not None:
+        with compressed_bodies_lock:
+            compressed = compressed_bodies.get(key)
+            if compressed is not None:
+                compressed_bodies.move_to_end(key)
+                return compressed
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=4)
+    else:
+        compressed = gzip.compress(body, compresslevel=5)
+    if key is not None:
+        with compressed_bodies_lock:
+            compressed_bodies[key] = compressed
+            while len(compressed_bodies) > 32:
+                compressed_bodies.popitem(last=False)
+    return compressed
+
+
+def listing_tags():
+    category = request.args.get('category')
+    if category is not None and request.args.get('searchValue') is None:
+        return {'category:{}'.format(category.replace("_", " "))}
+    return {'catalog'}
+
+
+def load_profiles(ids):
+    rows = db.session.query(Usernew.id, Usernew.firstname, Usernew.lastname, Usernew.email,
+                            Usernew.role, Usernew.premium).filter(Usernew.id.in_(list(ids)))
+    return [Profile(*row) for row in rows]
+
+
+profile_cache = ProfileCache(load_profiles, ttl=app.config['USER_CACHE_TTL'],
+                             max_entries=app.config['USER_CACHE_MAX_ENTRIES'])
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_changed_users(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Usernew):
+            session.info.setdefault('changed_users', set()).add(obj.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_changed_users(session):
+    changed = session.info.pop('changed_users', None)
+    if changed:
+        profile_cache.invalidate(changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changed_users(session):
+    session.info.pop('changed_users', None)
+
+
+def user_names(ids):
+    """First names by user id, for chat messages."""
+    return {user_id: profile.firstname for user_id, profile in profile_cache.get_many(ids).items()}
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return Usernew.query.get(int(user_id))
+    return profile_cache.get(user_id)
+
+
+def busy_response():
+    response = jsonify({'Error': 'Server busy, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -108,8 +590,6 @@ def register():
             lastname = data['lastname']
             email = data['email']
             mobile = data['mobile']
-            password = generate_password_hash(
-                data['password'], method='sha256')
             isPremiumSeller = data['isPremiumSeller']
 
             # Check if user already exists
@@ -117,6 +597,8 @@ def register():
                 flash('Email address already exists')
                 return Response(response=json.dumps({"Value": 'User Already Exists'}), status=200)
 
+            password = password_hasher.hash(data['password'])
+
             user = Usernew(firstname=firstname, lastname=lastname, email=email,
                            mobile=mobile, password=password, role=role, premium=isPremiumSeller)
 
@@ -125,6 +607,8 @@ def register():
 
             return Response(response=json.dumps({'firstname': user.firstname, 'lastname': user.lastname, 'email': user.email, 'password': user.password, 'role': user.role}), status=201)
 
+    except Busy:
+        return busy_response()
     except Exception as e:
         return jsonify({'Error': str(e)})
 
@@ -141,7 +625,19 @@ def login():
 
         user = Usernew.query.filter_by(email=email).first()
 
-        if user and check_password_hash(user.password, password):
+        try:
+            valid = user is not None and password_hasher.verify(user.password, password)
+        except Busy:
+            return busy_response()
+        if valid and password_hasher.needs_rehash(user.password):
+            # Legacy sha256 or other parameters: store the current method.
+            try:
+                user.password = password_hasher.hash(password)
+                db.session.commit()
+            except Busy:
+                pass  # Upgraded on a later login.
+
+        if valid:
             login_user(user)
             global current_user_id
             session['user_id'] = current_user_id
@@ -191,43 +687,26 @@ def logout():
 
 
 @app.route('/addproduct', methods=['GET', 'POST', 'PUT', 'DELETE'])
+@catalog_etag
+@cached_response(listing_tags)
+@replica_router.reads()
 def add_product():
     if request.method == 'GET':
         category = request.args.get('category')
-        searchValue = request.args.get('searchValue')
-        print(searchValue)
-        if category is None and searchValue is None:
-            # Retrieve all products from the database
-            products = Product.query.all()
-        elif searchValue is not None and category is None:
-            search = "%{}%".format(searchValue)
-            products = Product.query.filter(
-                Product.name.like(search)).all()
-        else:
+        # An empty search box lists everything, as it always has.
+        searchValue = (request.args.get('searchValue') or '').strip() or None
+        # Single query on product alone (the seller's premium flag is
+        # denormalized), projecting only the columns in the response.
+        fields = requested_fields(product_schema.keys())
+        query = catalog_query(fields)
+        if searchValue is not None and category is None:
+            query = query.filter(product_search.clause(db.session, searchValue))
+        elif category is not None:
             category = category.replace("_", " ")
-            products = Product.query.filter_by(category=category).all()
-        data = []
-
-        for product in products:
-            user = Usernew.query.filter_by(id=product.user_id).first()
-            user_details = Usernew.query.filter_by(id=product.user_id).first()
-            product_data = {
-                'id': product.id,
-                'name': product.name,
-                'category': product.category,
-                'description': product.description,
-                'count': product.count,
-                'price': product.price,
-                'discounted_price': product.discounted_price,
-                'offer_valid_till': product.offer_expiration,
-                'is_premium_seller': user.premium,
-                'image': product.image,
-                'premium_seller': user_details.premium
-            }
-
-            data.append(product_data)
+            query = query.filter(Product.category == category)
 
-        return jsonify(data)
+        rows, next_after = paginate(query)
+        return page_response(rows, fields, next_after)
 
     elif request.method == 'POST':
         # Create or update a product
@@ -242,6 +721,15 @@ def add_product():
         # New field for offer duration in hours
         offer_duration = data.get('offerDuration')
         image = data.get('imageBinary')
+        image_data = None
+        if image:
+            try:
+                image_data = imagestore.decode_upload(image, app.config['MAX_IMAGE_BYTES'])
+            except imagestore.ImageTooLarge as e:
+                return jsonify({'Error': str(e)}), 413
+            except ValueError as e:
+                return jsonify({'Error': str(e)}), 400
+            image = imagestore.digest_of(image_data)
 
         existing_product = Product.query.filter_by(
             name=name, user_id=id).first()
@@ -301,10 +789,25 @@ def add_product():
                 product.image = None
 
             db.session.add(product)
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # uq_product_user_id_name: the same seller created this
+                # product concurrently; the client can retry as an update.
+                db.session.rollback()
+                return jsonify({'Error': 'Product already exists, please retry'}), 409
             updated_product = product
             message = "Product created successfully"
 
+        # Only stored once the row is committed, so a rejected product
+        # leaves no file behind.
+        if image_data is not None:
+            imagestore.save(app.config['IMAGE_STORE'], image_data)
+
+        catalog_cache.invalidate(product_tags(updated_product.id, updated_product.category))
+        if updated_product.image:
+            image_variants.submit(updated_product.image)
+
         response_data = {
             'message': message,
             'product': {
@@ -322,6 +825,300 @@ def add_product():
         return jsonify(response_data)
 
 
+BULK_CHUNK_SIZE = 500
+
+
+def bulk_rows():
+    """Yields (row number, dict) from a CSV, NDJSON or JSON array body.
+
+    CSV and NDJSON are read line by line from the request stream.
+    """
+    mimetype = request.mimetype
+    if mimetype in ('text/csv', 'application/csv'):
+        reader = csv.DictReader(io.TextIOWrapper(request.stream, encoding='utf-8-sig'))
+        for number, row in enumerate(reader, start=1):
+            yield number, row
+    elif mimetype == 'application/x-ndjson':
+        number = 0
+        for line in io.TextIOWrapper(request.stream, encoding='utf-8'):
+            if line.strip():
+                number += 1
+                yield number, json.loads(line)
+    else:
+        data = request.get_json()
+        rows = data.get('products', []) if isinstance(data, dict) else data
+        for number, row in enumerate(rows, start=1):
+            yield number, row
+
+
+def validate_bulk_row(row, user_id, now):
+    """Values for one upsert, with the same count/offer rules as add_product()."""
+    if not isinstance(row, dict):
+        raise ValueError('Row must be an object')
+    name = (row.get('name') or '').strip()
+    category = (row.get('category') or '').strip()
+    if not name or not category:
+        raise ValueError('name and category are required')
+    count = int(row.get('count') or 0)
+    if count < 0:
+        raise ValueError('count must not be negative')
+    price = float(row.get('price') or 0)
+    offer = float(row.get('offer') or 0)
+    values = {
+        'user_id': user_id,
+        'name': name,
+        'category': category,
+        'description': row.get('description') or '',
+        'count': count,
+        'price': price,
+        'discounted_price': 0,
+        'hasDiscount': False,
+        'offer_price': None,
+        'offer_expiration': None,
+        'updated_at': now
+    }
+    if offer:
+        duration = row.get('offerDuration')
+        if duration in (None, ''):
+            raise ValueError('offerDuration is required with an offer')
+        values['discounted_price'] = price - (price * (offer / 100))
+        values['hasDiscount'] = True
+        values['offer_price'] = offer
+        values['offer_expiration'] = now + timedelta(hours=float(duration))
+    return values
+
+
+def product_upsert():
+    """INSERT ... ON CONFLICT (user_id, name) DO UPDATE, like add_product().
+
+    An existing product gets the new count added to its stock, and its
+    price, description and offer replaced. Category and image are kept.
+    """
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    table = Product.__table__
+    stmt = dialect.insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.name],
+        set_={
+            'count': table.c.count + stmt.excluded['count'],
+            'price': stmt.excluded.price,
+            'description': stmt.excluded.description,
+            'discounted_price': stmt.excluded.discounted_price,
+            'hasDiscount': stmt.excluded.hasDiscount,
+            'offer_price': stmt.excluded.offer_price,
+            'offer_expiration': stmt.excluded.offer_expiration,
+            'seller_premium': stmt.excluded.seller_premium,
+            'updated_at': stmt.excluded.updated_at
+        })
+
+
+@app.route('/products/bulk', methods=['POST'])
+def bulk_upsert_products():
+    """Creates or updates many products of one seller in one transaction.
+
+    Accepts CSV (text/csv), NDJSON, or a JSON array (or {"userId", "products"})
+    of rows shaped like add_product()'s body. The seller comes from ?userId=
+    or the JSON object. Invalid rows are skipped and reported by row number.
+    """
+    try:
+        user_id = request.args.get('userId', type=int)
+        if user_id is None and request.is_json:
+            data = request.get_json()
+            if isinstance(data, dict) and data.get('userId') is not None:
+                user_id = int(data['userId'])
+        if user_id is None:
+            return jsonify({'Error': 'userId is required'}), 400
+        now = datetime.utcnow()
+        seller_premium = bool(db.session.query(Usernew.premium).filter_by(id=user_id).scalar())
+        stmt = product_upsert()
+        errors = []
+        written = 0
+        tags = {'catalog'}
+
+        def flush(chunk):
+            # Rows of the same product within a chunk are merged first: one
+            # statement must not upsert the same row twice.
+            db.session.execute(stmt, list(chunk.values()))
+            rows = db.session.query(Product.id, Product.name, Product.description,
+                                    Product.category).filter(
+                Product.user_id == user_id, Product.name.in_(list(chunk))).all()
+            product_search.record_rows(db.session, rows)
+            for row in rows:
+                tags.update(product_tags(row.id, row.category))
+                expires_at = chunk[row.name]['offer_expiration']
+                if expires_at is not None:
+                    # Scheduled by schedule_offer_expirations on commit.
+                    db.session.info.setdefault('offer_expirations', []).append((row.id, expires_at))
+            chunk.clear()
+
+        chunk = {}
+        for number, row in bulk_rows():
+            try:
+                values = validate_bulk_row(row, user_id, now)
+            except (TypeError, ValueError) as e:
+                errors.append({'row': number, 'error': str(e)})
+                continue
+            values['seller_premium'] = seller_premium
+            previous = chunk.get(values['name'])
+            if previous is not None:
+                values['count'] += previous['count']
+            chunk[values['name']] = values
+            written += 1
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                flush(chunk)
+        if chunk:
+            flush(chunk)
+        db.session.commit()
+
+        if written:
+            catalog_cache.invalidate(tags)
+        return jsonify({'message': 'Bulk import finished', 'written': written,
+                        'failed': len(errors), 'errors': errors})
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'Error': str(e)}), 400
+
+
+@app.route('/search', methods=['GET'])
+@catalog_etag
+@replica_router.reads()
+def search_products():
+    q = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 20, type=int), MAX_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    fields = requested_fields(product_schema.keys())
+
+    # One extra id tells us whether there is a next page.
+    ids = product_search.search(db.session, q, limit + 1, offset)
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    rows = catalog_query(fields).filter(Product.id.in_(ids)).all() if ids else []
+    rank = {product_id: i for i, product_id in enumerate(ids)}
+    rows.sort(key=lambda row: rank[row.cursor_id])
+
+    headers = {'X-Next-Offset': str(offset + limit)} if has_more else None
+    return json_response(product_schema.dump(rows, fields), headers=headers)
+
+
+@app.route('/suggest', methods=['GET'])
+def suggest_products():
+    q = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify(product_suggester.suggest(db.session, q, limit))
+
+
+@app.route('/images/<digest>', methods=['GET'])
+def get_image(digest):
+    if not imagestore.is_digest(digest):
+        abort(404)
+    path = imagestore.path_for(app.config['IMAGE_STORE'], digest)
+    if not os.path.exists(path):
+        abort(404)
+    # The digest is the content, so it doubles as a strong ETag and the
+    # file can never change under the same URL. conditional=True handles
+    # If-None-Match and Range requests.
+    response = send_file(path, mimetype=imagestore.sniff_mimetype(path),
+                         etag=digest, conditional=True, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/images/<digest>/<int:width>.<fmt>', methods=['GET'])
+def get_image_variant(digest, width, fmt):
+    if width not in imagestore.VARIANT_WIDTHS or fmt not in imagestore.VARIANT_FORMATS:
+        abort(404)
+    if not imagestore.is_digest(digest):
+        abort(404)
+    root = app.config['IMAGE_STORE']
+    path = imagestore.variant_path(root, digest, width, fmt)
+    if os.path.exists(path):
+        response = send_file(path, mimetype='image/' + fmt, conditional=True,
+                             etag='{}.w{}.{}'.format(digest, width, fmt),
+                             max_age=31536000)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    # Not rendered yet (or rendering failed): queue it and fall back to the
+    # original, without letting the browser cache the fallback for long.
+    if not os.path.exists(imagestore.path_for(root, digest)):
+        abort(404)
+    image_variants.submit(digest)
+    response = get_image(digest)
+    response.cache_control.immutable = False
+    response.cache_control.max_age = 60
+    return response
+
+
+@app.cli.command('migrate-images')
+def migrate_images():
+    """Moves images still stored inline in Product.image to the blob store."""
+    moved = 0
+    for product in Product.query.filter(Product.image.isnot(None)).yield_per(100):
+        if imagestore.is_digest(product.image):
+            continue
+        try:
+            data = imagestore.decode_upload(product.image)
+        except ValueError:
+            print('Skipping product {}: undecodable image'.format(product.id))
+            continue
+        product.image = imagestore.save(app.config['IMAGE_STORE'], data)
+        moved += 1
+    db.session.commit()
+    print('Moved {} images'.format(moved))
+
+
+@app.cli.command('generate-image-variants')
+def generate_image_variants():
+    """Renders any missing responsive variants for stored product images."""
+    digests = {image for image, in db.session.query(Product.image).distinct()
+               if imagestore.is_digest(image)}
+    futures = [image_variants.submit(digest) for digest in digests]
+    rendered = sum(f.result() for f in futures if f is not None)
+    image_variants.shutdown()
+    print('Rendered {} variants for {} images'.format(rendered, len(digests)))
+
+
+@app.cli.command('check-seller-premium')
+@click.option('--repair', is_flag=True, help='Rewrite the products that drifted.')
+def check_seller_premium(repair):
+    """Finds products whose seller_premium differs from their seller's premium.
+
+    Exits with status 1 when drift is found and --repair was not given.
+    """
+    expected = db.func.coalesce(Usernew.premium, db.false())
+    drifted = db.session.query(Product.id, Product.category, Product.user_id, expected).outerjoin(
+        Usernew, Usernew.id == Product.user_id).filter(Product.seller_premium != expected).all()
+    sellers = {row.user_id for row in drifted}
+    print('{} products of {} sellers out of sync'.format(len(drifted), len(sellers)))
+    if not drifted:
+        return
+    if not repair:
+        raise SystemExit(1)
+    table = Product.__table__
+    for start in range(0, len(drifted), BULK_CHUNK_SIZE):
+        db.session.execute(table.update().where(table.c.id == db.bindparam('product_id')).values(
+            seller_premium=db.bindparam('premium')), [
+            {'product_id': row[0], 'premium': bool(row[3])}
+            for row in drifted[start:start + BULK_CHUNK_SIZE]])
+    db.session.commit()
+    tags = set()
+    for row in drifted:
+        tags.update(product_tags(row[0], row[1]))
+    catalog_cache.invalidate(tags)
+    print('Repaired {} products'.format(len(drifted)))
+
+
+# Decrements stock only while enough is left, so concurrent orders can
+# never drive a product's count below zero.
+reserve_stock = Product.__table__.update().where(
+    Product.__table__.c.id == db.bindparam('product_id'),
+    Product.__table__.c.count >= db.bindparam('quantity')
+).values(count=Product.__table__.c.count - db.bindparam('quantity'))
+
+
 @app.route('/placeorder', methods=['POST'])
 def place_order():
     try:
@@ -330,40 +1127,169 @@ def place_order():
         city = data.get('city')
         state = data.get('state')
         pincode = data.get('pincode')
-        items = data.get('items')
+        items = data.get('items') or []
+
+        # Same product listed twice in the cart is one decrement.
+        quantities = {}
+        for item in items:
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity'])
+            if quantity <= 0:
+                return jsonify({'Error': 'Quantity must be positive'}), 400
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        if not quantities:
+            return jsonify({'Error': 'Order has no items'}), 400
+
+        products = db.session.query(Product.id, Product.name, Product.category).filter(
+            Product.id.in_(list(quantities))).all()
+        names = {product.id: product.name for product in products}
+        unknown = [product_id for product_id in quantities if product_id not in names]
+        if unknown:
+            return jsonify({'Error': 'Unknown products', 'items': [
+                {'product_id': product_id} for product_id in unknown]}), 404
+
+        # Order, order items and stock decrements commit or fail together.
+        result = db.session.execute(reserve_stock, [
+            {'product_id': product_id, 'quantity': quantity}
+            for product_id, quantity in quantities.items()])
+        if result.rowcount != len(quantities):
+            db.session.rollback()
+            stock = dict(db.session.query(Product.id, Product.count).filter(
+                Product.id.in_(list(quantities))).all())
+            short = [{
+                'product_id': product_id,
+                'product_name': names[product_id],
+                'requested': quantity,
+                'available': stock.get(product_id, 0)
+            } for product_id, quantity in quantities.items()
+                if stock.get(product_id, 0) < quantity]
+            return jsonify({'Error': 'Insufficient stock', 'items': short}), 409
 
         order = Order(address=address, city=city, state=state, pincode=pincode)
         db.session.add(order)
+        for product_id, quantity in quantities.items():
+            db.session.add(OrderItem(
+                product_name=names[product_id], quantity=quantity, order=order))
         db.session.commit()
 
-        for item in items:
-            product_name = item.get('product_name')
-            quantity = item.get('quantity')
-            order_item = OrderItem(
-                product_name=product_name, quantity=quantity, order=order)
-            db.session.add(order_item)
-
-        # Update product count
-        for item in items:
-            product_name = item.get('product_name')
-            quantity = item.get('quantity')
-            product = Product.query.filter_by(name=product_name).first()
-            if product:
-                product.count -= quantity
-                db.session.commit()
+        for product in products:
+            catalog_cache.invalidate(product_tags(product.id, product.category))
 
-        return jsonify({'message': 'Order placed successfully'})
+        return jsonify({'message': 'Order placed successfully', 'order_id': order.id})
 
     except Exception as e:
+        db.session.rollback()
         return jsonify({'Error': str(e)})
 
 
+EXPORT_BATCH_SIZE = 1000
+
+
+def parse_since():
+    since = request.args.get('since')
+    return datetime.fromisoformat(since) if since else None
+
+
+def stream_rows(query):
+    """Batches of rows from a server-side cursor (yield_per)."""
+    return db.session.execute(
+        query.statement, execution_options={'yield_per': EXPORT_BATCH_SIZE}).partitions()
+
+
+def ndjson_response(lines):
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+@app.route('/export/products.ndjson', methods=['GET'])
+def export_products():
+    """Streams the catalog as one JSON object per line.
+
+    Rows are fetched in batches of EXPORT_BATCH_SIZE while the response is
+    written, so memory does not grow with the table. ?since=<iso ts> limits
+    the export to products changed after that time, oldest first.
+    """
+    try:
+        since = parse_since()
+    except ValueError:
+        return jsonify({'Error': 'since must be an ISO timestamp'}), 400
+    fields = [f for f in product_schema.keys() if f != 'image_srcset']
+    query = catalog_query(fields)
+    if since is not None:
+        query = query.filter(Product.updated_at > since)
+    query = query.order_by(Product.updated_at, Product.id)
+
+    def lines():
+        for batch in stream_rows(query):
+            yield b''.join(dumps(item) + b'\n' for item in product_schema.dump(batch, fields))
+
+    return ndjson_response(lines())
+
+
+@app.route('/export/orders.ndjson', methods=['GET'])
+def export_orders():
+    """Streams orders with their items, one order per line (see export_products)."""
+    try:
+        since = parse_since()
+    except ValueError:
+        return jsonify({'Error': 'since must be an ISO timestamp'}), 400
+    query = db.session.query(
+        Order.id, Order.address, Order.city, Order.state, Order.pincode, Order.created_at,
+        OrderItem.product_name, OrderItem.quantity
+    ).outerjoin(OrderItem, OrderItem.order_id == Order.id)
+    if since is not None:
+        query = query.filter(Order.created_at > since)
+    query = query.order_by(Order.created_at, Order.id, OrderItem.id)
+
+    def lines():
+        # Item rows of one order are adjacent; emit the order once its last
+        # item has been read.
+        order = None
+        for batch in stream_rows(query):
+            out = []
+            for row in batch:
+                if order is None or order['id'] != row.id:
+                    if order is not None:
+                        out.append(dumps(order) + b'\n')
+                    order = {'id': row.id, 'address': row.address, 'city': row.city,
+                             'state': row.state, 'pincode': row.pincode,
+                             'created_at': row.created_at and row.created_at.isoformat(),
+                             'items': []}
+                if row.product_name is not None:
+                    order['items'].append({'product_name': row.product_name,
+                                           'quantity': row.quantity})
+            yield b''.join(out)
+        if order is not None:
+            yield dumps(order) + b'\n'
+
+    return ndjson_response(lines())
+
+
 @app.route('/products/<category>')
+@catalog_etag
+@cached_response(lambda category: {'category:{}'.format(category)})
+@replica_router.reads()
 def get_products_by_category(category):
-    products = Product.query.filter_by(category=category).all()
-    serialized_products = [{'name': p.name, 'count': p.count, 'price': float(
-        p.price), 'discounted_price': float(p.discounted_price)} for p in products]
-    return jsonify(serialized_products)
+    fields = requested_fields(SUMMARY_FIELDS)
+    query = catalog_query(fields).filter(Product.category == category)
+    rows, next_after = paginate(query)
+    return page_response(rows, fields, next_after)
+
+
+@app.route('/offers/active', methods=['GET'])
+@catalog_etag
+@cached_response(lambda: {'catalog'})
+@replica_router.reads()
+def get_active_offers():
+    """Products with a running offer, read through ix_product_has_discount.
+
+    Expired offers are cleared by offer_expiry; the expiry filter only
+    covers the moment between an offer lapsing and that UPDATE.
+    """
+    fields = requested_fields(product_schema.keys())
+    query = catalog_query(fields).filter(Product.hasDiscount == db.true(),
+                                         Product.offer_expiration > datetime.utcnow())
+    rows, next_after = paginate(query)
+    return page_response(rows, fields, next_after)
 
 
 @app.route('/chat', methods=['POST'])
@@ -380,88 +1306,272 @@ def send_chat_message():
         db.session.add(chat_message)
         db.session.commit()
 
+        # Push to the receiver's open streams, and the sender's other tabs.
+        names = user_names([sender_id, receiver_id])
+        event = chat_event(chat_message, names)
+        chat_hub.publish(chat_channel(receiver_id), event)
+        if sender_id != receiver_id:
+            chat_hub.publish(chat_channel(sender_id), event)
+
         return jsonify({'message': 'Chat message sent successfully'})
 
     except Exception as e:
         return jsonify({'error': str(e)})
 
 
+# Chat reads select plain row tuples instead of ChatMessage objects.
+MESSAGE_COLUMNS = (ChatMessage.id, ChatMessage.sender_id, ChatMessage.receiver_id,
+                   ChatMessage.message, ChatMessage.timestamp)
+
+
+def serialize_message(msg, user_id, names):
+    return {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'firstName': names.get(msg.sender_id),
+        'message': msg.message,
+        'timestamp': msg.timestamp,
+        'type': 'sent' if msg.sender_id == user_id else 'received'
+    }
+
+
+def chat_channel(user_id):
+    return 'chat:{}'.format(user_id)
+
+
+def chat_event(msg, names):
+    return {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'receiver_id': msg.receiver_id,
+        'firstName': names.get(msg.sender_id),
+        'reciever_name': names.get(msg.receiver_id),
+        'message': msg.message,
+        'timestamp': http_date(msg.timestamp)
+    }
+
+
+def format_sse(event, user_id):
+    event = dict(event, type='sent' if event['sender_id'] == user_id else 'received')
+    return 'id: {}\ndata: {}\n\n'.format(event['id'], dumps(event).decode())
+
+
+@app.route('/chat/stream', methods=['GET'])
+def stream_chat():
+    """Server-Sent Events stream of a user's new chat messages.
+
+    A reconnecting EventSource sends Last-Event-ID; messages after it are
+    replayed from the database once, then only pushed messages are sent.
+    An idle stream does not touch the database.
+    """
+    user_id = int(request.args.get('sender_id'))
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_id', type=int)
+    keepalive = app.config['CHAT_KEEPALIVE_SECONDS']
+
+    # Subscribe before reading the backlog so nothing sent in between is lost.
+    subscription = chat_hub.subscribe(chat_channel(user_id))
+    backlog = []
+    if last_id is not None:
+        messages = db.session.query(*MESSAGE_COLUMNS).filter(
+            ChatMessage.id > last_id,
+            db.or_(ChatMessage.sender_id == user_id, ChatMessage.receiver_id == user_id)
+        ).order_by(ChatMessage.id).all()
+        user_ids = {m.sender_id for m in messages} | {m.receiver_id for m in messages}
+        names = user_names(user_ids) if user_ids else {}
+        backlog = [chat_event(m, names) for m in messages]
+        if backlog:
+            last_id = backlog[-1]['id']
+    db.session.remove()
+
+    # Pushes can arrive out of id order (each sender publishes after its own
+    # commit), so only drop what the backlog already replayed.
+    replayed = last_id or 0
+
+    def events():
+        for event in backlog:
+            yield format_sse(event, user_id)
+        while not subscription.closed:
+            event = subscription.get(timeout=keepalive)
+            if event is None:
+                yield ': keepalive\n\n'
+            elif event['id'] > replayed:
+                yield format_sse(event, user_id)
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(subscription.close)
+    return response
+
+
 @app.route('/chat', methods=['GET'])
 def get_chat_conversations():
     try:
-        sender_id = request.args.get('sender_id')
-
-        # Retrieve chat conversations for the specified sender
-        sent_messages = ChatMessage.query.filter_by(sender_id=sender_id).all()
-        received_messages = ChatMessage.query.filter_by(
-            receiver_id=sender_id).all()
-
-        conversations = []
-
-        # Group messages by receiver_id to form separate conversations
-        for msg in sent_messages:
-            conversation = next(
-                (conv for conv in conversations if conv['receiver_id'] == msg.receiver_id), None)
-            user = Usernew.query.filter_by(id=msg.sender_id).first()
-            if conversation:
-                conversation['messages'].append({
-                    'sender_id': msg.sender_id,
-                    'firstName': user.firstname,
-                    'message': msg.message,
-                    'timestamp': msg.timestamp,
-                    'type': 'sent'
-                })
-            else:
-                reciever_details = Usernew.query.filter_by(
-                    id=msg.receiver_id).first()
-                conversations.append({
-                    'receiver_id': msg.receiver_id,
-                    'reciever_name': reciever_details.firstname,
-                    'messages': [{
-                        'sender_id': msg.sender_id,
-                        'firstName': user.firstname,
-                        'message': msg.message,
-                        'timestamp': msg.timestamp,
-                        'type': 'sent'
-                    }]
-                })
-
-        for msg in received_messages:
-            conversation = next(
-                (conv for conv in conversations if conv['receiver_id'] == msg.sender_id), None)
-            user = Usernew.query.filter_by(id=msg.sender_id).first()
-            if conversation:
-                conversation['messages'].append({
-                    'sender_id': msg.sender_id,
-                    'firstName': user.firstname,
-                    'message': msg.message,
-                    'timestamp': msg.timestamp,
-                    'type': 'received'
-                })
+        sender_id = int(request.args.get('sender_id'))
+
+        # Both directions in one query, oldest first.
+        messages = db.session.query(*MESSAGE_COLUMNS).filter(db.or_(
+            ChatMessage.sender_id == sender_id,
+            ChatMessage.receiver_id == sender_id
+        )).order_by(ChatMessage.timestamp, ChatMessage.id).all()
+
+        user_ids = {sender_id}
+        user_ids.update(msg.receiver_id if msg.sender_id == sender_id else msg.sender_id
+                        for msg in messages)
+        names = user_names(user_ids)
+
+        # Group messages by the other participant to form separate conversations
+        conversations = {}
+        for msg in messages:
+            sent = msg.sender_id == sender_id
+            counterpart = msg.receiver_id if sent else msg.sender_id
+            conversation = conversations.get(counterpart)
+            if conversation is None:
+                conversation = conversations[counterpart] = {
+                    'receiver_id': counterpart,
+                    'reciever_name': names.get(counterpart),
+                    'messages': []
+                }
+            conversation['messages'].append(serialize_message(msg, sender_id, names))
+
+        return json_response(list(conversations.values()))
+
+    except Exception as e:
+        return jsonify({'Error': str(e)})
+
+
+@app.route('/chat/inbox', methods=['GET'])
+def get_chat_inbox():
+    try:
+        user_id = int(request.args.get('sender_id'))
+
+        # One row per counterpart: its latest message and the number of
+        # messages from it that the user has not read yet.
+        counterpart = db.case((ChatMessage.sender_id == user_id, ChatMessage.receiver_id),
+                              else_=ChatMessage.sender_id)
+        unread = db.case((db.and_(ChatMessage.receiver_id == user_id,
+                                  ChatMessage.read_at.is_(None)), 1), else_=0)
+        ranked = db.select(
+            counterpart.label('counterpart'),
+            ChatMessage.id, ChatMessage.sender_id, ChatMessage.message, ChatMessage.timestamp,
+            db.func.row_number().over(
+                partition_by=counterpart,
+                order_by=(ChatMessage.timestamp.desc(), ChatMessage.id.desc())).label('position'),
+            db.func.sum(unread).over(partition_by=counterpart).label('unread')
+        ).where(db.or_(ChatMessage.sender_id == user_id,
+                       ChatMessage.receiver_id == user_id)).subquery()
+        rows = db.session.execute(
+            db.select(ranked, Usernew.firstname)
+            .outerjoin(Usernew, Usernew.id == ranked.c.counterpart)
+            .where(ranked.c.position == 1)
+            .order_by(ranked.c.timestamp.desc(), ranked.c.id.desc())
+        ).all()
+
+        return json_response([{
+            'receiver_id': row.counterpart,
+            'reciever_name': row.firstname,
+            'last_message': row.message,
+            'last_message_type': 'sent' if row.sender_id == user_id else 'received',
+            'timestamp': row.timestamp,
+            'unread_count': row.unread
+        } for row in rows])
+
+    except Exception as e:
+        return jsonify({'Error': str(e)})
+
+
+@app.route('/chat/<int:counterpart_id>', methods=['GET'])
+def get_chat_thread(counterpart_id):
+    """One conversation, newest page first, paginated with ?before=<ts>&before_id=<id>&limit=.
+
+    Messages in the page are oldest first. The X-Next-Before (ISO timestamp)
+    and X-Next-Before-Id headers hold the cursor for the previous page; the
+    id breaks ties between messages sent in the same instant.
+    """
+    try:
+        user_id = int(request.args.get('sender_id'))
+        limit = max(1, min(request.args.get('limit', 50, type=int), MAX_PAGE_SIZE))
+        before = request.args.get('before')
+        before_id = request.args.get('before_id', type=int)
+
+        query = db.session.query(*MESSAGE_COLUMNS).filter(db.or_(
+            db.and_(ChatMessage.sender_id == user_id, ChatMessage.receiver_id == counterpart_id),
+            db.and_(ChatMessage.sender_id == counterpart_id, ChatMessage.receiver_id == user_id)
+        ))
+        if before:
+            before = datetime.fromisoformat(before)
+            if before_id is None:
+                query = query.filter(ChatMessage.timestamp < before)
             else:
-                conversations.append({
-                    'receiver_id': msg.sender_id,
-                    'messages': [{
-                        'sender_id': msg.sender_id,
-                        'firstName': user.firstname,
-                        'message': msg.message,
-                        'timestamp': msg.timestamp,
-                        'type': 'received'
-                    }]
-                })
-
-        return jsonify(conversations)
+                query = query.filter(db.or_(
+                    ChatMessage.timestamp < before,
+                    db.and_(ChatMessage.timestamp == before, ChatMessage.id < before_id)))
+        messages = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()) \
+            .limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+
+        names = user_names([user_id, counterpart_id])
+        headers = {'X-Next-Before': messages[0].timestamp.isoformat(),
+                   'X-Next-Before-Id': str(messages[0].id)} if has_more else None
+        return json_response([serialize_message(msg, user_id, names) for msg in messages],
+                             headers=headers)
+
+    except Exception as e:
+        return jsonify({'Error': str(e)})
+
+
+@app.route('/chat/<int:counterpart_id>/read', methods=['POST'])
+def mark_chat_read(counterpart_id):
+    try:
+        data = request.get_json()
+        user_id = int(data.get('sender_id'))
+        updated = ChatMessage.query.filter(
+            ChatMessage.sender_id == counterpart_id,
+            ChatMessage.receiver_id == user_id,
+            ChatMessage.read_at.is_(None)
+        ).update({ChatMessage.read_at: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return jsonify({'message': 'Messages marked as read', 'count': updated})
 
     except Exception as e:
         return jsonify({'Error': str(e)})
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    stats = catalog_cache.stats()
+    stats['users'] = profile_cache.stats()
+    return jsonify(stats)
+
+
 @app.route('/usernew', methods=['GET'])
 def get_user_first_name():
-    receiver_id = request.args.get('id')
+    ids = request.args.get('ids')
+    if ids is not None:
+        # Batch form for the chat UI: ?ids=1,2,3 -> every name in one call.
+        try:
+            ids = [int(user_id) for user_id in ids.split(',') if user_id]
+        except ValueError:
+            return jsonify(error='ids must be comma-separated integers'), 400
+        if len(ids) > MAX_PAGE_SIZE:
+            return jsonify(error='At most {} ids'.format(MAX_PAGE_SIZE)), 400
+        profiles = profile_cache.get_many(ids)
+        return jsonify(users=[{'id': user_id, 'firstName': profiles[user_id].firstname}
+                              for user_id in ids if user_id in profiles],
+                       missing=[user_id for user_id in ids if user_id not in profiles])
+
+    receiver_id = request.args.get('id', type=int)
 
     # Fetch user details from the 'usernew' table based on the receiver ID
-    user = Usernew.query.filter_by(id=receiver_id).first()
+    user = profile_cache.get(receiver_id) if receiver_id is not None else None
 
     if user is None:
         return jsonify(error='User not found'), 404
@@ -471,6 +1581,8 @@ def get_user_first_name():
 
 
 @app.route('/product/<int:product_id>', methods=['GET'])
+@catalog_etag
+@replica_router.reads()
 def get_product(product_id):
     try:
         product = Product.query.with_entities(
@@ -488,43 +1600,34 @@ def get_product(product_id):
         return jsonify({'error': str(e)})
 
 @app.route('/sellerproducts', methods=['POST','GET'])
+@replica_router.reads(methods=('GET', 'POST'))  # POST only carries the form.
 def sellerproducts():
     try:
         userid = request.form.get("userId")
-        print(userid)
-        data = []
-        myproducts = Product.query.filter_by(user_id=userid).all()
-        for product in myproducts:
-            my_data = {
-                'name': product.name,
-                'count': product.count,
-                'price': product.price,
-                'discounted_price': product.discounted_price
-            }
-            data.append(my_data)
-
-        return jsonify(data)
+        fields = requested_fields(SUMMARY_FIELDS)
+        query = catalog_query(fields).filter(Product.user_id == userid)
+        rows, next_after = paginate(query)
+        return page_response(rows, fields, next_after)
     
     except Exception as e:
         return jsonify({'Error': str(e)})
 
 @app.route('/product-detail/<int:product_id>', methods=['GET'])
+@catalog_etag
+@cached_response(lambda product_id: {'product:{}'.format(product_id)})
+@replica_router.reads()
 def get_product_detail(product_id):
     try:
         product = Product.query.with_entities(
-            Product.id, Product.name, Product.user_id).filter_by(id=product_id).first()
+            Product.id, Product.name, Product.user_id, Product.seller_premium).filter_by(id=product_id).first()
         if product:
-            user = Usernew.query.filter_by(id=product.user_id).first()
-            if user:
-                product_data = {
-                    'id': product.id,
-                    'name': product.name,
-                    'user_id': product.user_id,
-                    'is_premium_seller': user.premium
-                }
-                return jsonify(product_data)
-            else:
-                return jsonify({'error': 'User not found'})
+            product_data = {
+                'id': product.id,
+                'name': product.name,
+                'user_id': product.user_id,
+                'is_premium_seller': product.seller_premium
+            }
+            return jsonify(product_data)
         else:
             return jsonify({'error': 'Product not found'})
     except Exception as e:
@@ -539,18 +1642,12 @@ def editproduct():
         count = request.form.get("count")
         price = request.form.get("original_price")
         discount = request.form.get("discount")
-        # print(userid)
-        # print(name)
-        # print(price)
-        # print(discount)
         editproduct = Product.query.filter_by(name=name,user_id = userid).first()
-        # print(editproduct)
-        # print(editproduct.price)
         editproduct.price = int(price)
-        # print(editproduct.price)
         editproduct.discounted_price = editproduct.price - (editproduct.price * (int(discount) / 100))
         editproduct.count = editproduct.count + int(count)
         db.session.commit()
+        catalog_cache.invalidate(product_tags(editproduct.id, editproduct.category))
         return jsonify({'Message':"bid successfullt edited" })
     
     except Exception as e:
@@ -561,4 +1658,5 @@ if __name__ == '__main__':
     with app.app_context():
         db.create_all()
 
+    # Development server; serve.py is the production entry point.
     app.run(port=8000, debug=True)
@@ -0,0 +1,58 @@
+"""Throughput of POST /products/bulk on SQLite.
+
+Imports --rows CSV rows for one seller (all inserts), then the same file
+again (all updates), and exits non-zero when either pass is slower than
+--target rows per second.
+
+    python benchmarks/bulk_import.py --rows 20000 --target 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--target', type=float, default=10000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, ROOT)
+    from app import app, db, Usernew
+
+    with app.app_context():
+        db.create_all()
+        seller = Usernew(firstname='Bench', lastname='Seller', email='bench@example.com',
+                         mobile='0000000000', password='x', role='seller')
+        db.session.add(seller)
+        db.session.commit()
+        seller_id = seller.id
+
+    body = 'name,category,description,count,price,offer,offerDuration\n' + ''.join(
+        'Product {0},Bulk,Imported item {0},{1},2.5,{2},{3}\n'.format(
+            i, i % 50 + 1, 10 if i % 4 == 0 else '', 24 if i % 4 == 0 else '')
+        for i in range(args.rows))
+
+    client = app.test_client()
+    ok = True
+    for label in ('insert', 'update'):
+        start = time.perf_counter()
+        response = client.post('/products/bulk?userId={}'.format(seller_id),
+                               data=body, content_type='text/csv')
+        elapsed = time.perf_counter() - start
+        result = response.get_json()
+        rate = result['written'] / elapsed
+        print('{:<7} {:>7} rows {:>8.2f} s {:>10.0f} rows/s  ({} failed)'.format(
+            label, result['written'], elapsed, rate, result['failed']))
+        ok = ok and rate >= args.target
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Parallel writers against SQLite: orders and chat messages.
+
+Each of --writers threads alternates /placeorder and /chat posts. The
+script reports throughput and every failed request, and exits non-zero if
+any failure was a "database is locked" error. Engine settings come from the
+environment as in the app, so the old behaviour can be compared with e.g.
+
+    SQLITE_JOURNAL_MODE=delete SQLITE_BUSY_TIMEOUT=0 python benchmarks/concurrent_writes.py
+    python benchmarks/concurrent_writes.py --writers 16 --operations 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(app, db, Usernew, Product, writers):
+    with app.app_context():
+        db.create_all()
+        users = [Usernew(firstname='User{}'.format(i), lastname='Bench',
+                         email='user{}@example.com'.format(i), mobile=str(1000000000 + i),
+                         password='x', role='seller') for i in range(writers + 1)]
+        db.session.add_all(users)
+        db.session.flush()
+        products = [Product(name='Product {}'.format(i), category='Bench', description='d',
+                            user_id=users[0].id, price=1.0, count=10 ** 9) for i in range(10)]
+        db.session.add_all(products)
+        db.session.commit()
+        return [user.id for user in users], [product.id for product in products]
+
+
+def writer(app, index, operations, user_ids, product_ids, failures):
+    client = app.test_client()
+    for i in range(operations):
+        if i % 2:
+            response = client.post('/chat', json={
+                'sender_id': user_ids[index + 1], 'receiver_id': user_ids[0],
+                'message': 'message {} from writer {}'.format(i, index)})
+            body = response.get_json() or {}
+            error = body.get('error')
+        else:
+            response = client.post('/placeorder', json={
+                'address': 'a', 'city': 'c', 'state': 's', 'pincode': '1',
+                'items': [{'product_id': product_ids[(index + i) % len(product_ids)], 'quantity': 1},
+                          {'product_id': product_ids[(index + i + 1) % len(product_ids)], 'quantity': 1}]})
+            body = response.get_json() or {}
+            error = body.get('Error')
+        if error or response.status_code >= 400:
+            failures.append(error or response.status_code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--operations', type=int, default=100, help='requests per writer')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, ROOT)
+    from app import app, db, Usernew, Product
+
+    user_ids, product_ids = seed(app, db, Usernew, Product, args.writers)
+    failures = []
+    threads = [threading.Thread(target=writer, args=(
+        app, index, args.operations, user_ids, product_ids, failures))
+        for index in range(args.writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = args.writers * args.operations
+    locked = [failure for failure in failures if 'locked' in str(failure)]
+    print('{} writers, {} requests in {:.2f} s ({:.0f} req/s)'.format(
+        args.writers, total, elapsed, total / elapsed))
+    print('{} failed, {} with "database is locked"'.format(len(failures), len(locked)))
+    for failure in sorted(set(map(str, failures)))[:5]:
+        print('  ' + failure[:200])
+    sys.exit(1 if locked else 0)
+
+
+if __name__ == '__main__':
+    main()
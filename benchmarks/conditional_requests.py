@@ -0,0 +1,79 @@
+"""Bytes on the wire and latency of the /addproduct listing.
+
+Compares a plain response (what every client got before conditional
+requests and compression), gzip/brotli-compressed responses, and a
+revalidation that the server answers with 304 Not Modified.
+
+    python benchmarks/conditional_requests.py --products 5000 --requests 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(app, db, Usernew, Product, products):
+    with app.app_context():
+        db.create_all()
+        seller = Usernew(firstname='Bench', lastname='Seller', email='bench@example.com',
+                         mobile='0000000000', password='x', role='seller', premium=True)
+        db.session.add(seller)
+        db.session.flush()
+        db.session.add_all(Product(
+            name='Product {}'.format(i), category='Fruits',
+            description='Fresh produce item number {} from the benchmark seller'.format(i),
+            user_id=seller.id, price=1.5, count=100) for i in range(products))
+        db.session.commit()
+
+
+def measure(client, requests, headers):
+    timings = []
+    size = status = None
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get('/addproduct', headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+        size, status = len(response.data), response.status_code
+    return {
+        'status': status,
+        'bytes': size,
+        'p50_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, ROOT)
+    from app import app, db, Usernew, Product, brotli
+
+    seed(app, db, Usernew, Product, args.products)
+    client = app.test_client()
+    etag = client.get('/addproduct').headers['ETag']
+
+    scenarios = [('identity', {'Accept-Encoding': 'identity'}),
+                 ('gzip', {'Accept-Encoding': 'gzip'})]
+    if brotli is not None:
+        scenarios.append(('br', {'Accept-Encoding': 'br'}))
+    scenarios.append(('304 revalidation', {'Accept-Encoding': 'gzip', 'If-None-Match': etag}))
+
+    print('{} products, {} requests per scenario'.format(args.products, args.requests))
+    print('{:<18} {:>6} {:>10} {:>9} {:>9}'.format('scenario', 'status', 'bytes', 'p50 ms', 'mean ms'))
+    for name, headers in scenarios:
+        result = measure(client, args.requests, headers)
+        print('{:<18} {:>6} {:>10} {:>9} {:>9}'.format(
+            name, result['status'], result['bytes'], result['p50_ms'], result['mean_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Load test of every route, as JSON, with a regression check.
+
+Seeds a temporary SQLite database with --users, --products (a share of
+them with images), --orders and --messages, serves the app in-process with
+serve.py's threaded server and runs one phase per route: --clients threads
+send --requests requests between them over HTTP. Each phase reports
+
+- throughput (requests per second over the phase),
+- p50/p95/p99 and mean latency,
+- SQL statements per request, from the app's request metrics (/metrics),
+- errors: 5xx, connection failures, and {"Error": ...} bodies.
+
+The JSON goes to stdout and --output. Given a --baseline from an earlier
+run (e.g. on the previous commit), the script exits 1 when a route's p95
+latency or query count grew, or its throughput fell, by more than
+--max-regression percent, or when a route had errors:
+
+    python benchmarks/load_test.py --output before.json
+    git checkout my-branch
+    python benchmarks/load_test.py --baseline before.json --max-regression 15
+
+Latencies under --min-delta-ms apart are not counted as regressions, so
+sub-millisecond jitter on fast routes does not fail the run.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATEGORIES = ['Fruits', 'Vegetables', 'Dairy', 'Bakery', 'Beverages']
+
+
+def png(width, height, rgb):
+    """A solid-colour PNG, so no imaging library is needed to make uploads."""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    rows = b''.join(b'\x00' + bytes(rgb) * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def random_png():
+    return png(64, 64, [random.randrange(256) for _ in range(3)])
+
+
+def seed(args):
+    from app import (app, db, imagestore, Usernew, Product, Order, OrderItem,
+                     ChatMessage)
+    with app.app_context():
+        db.create_all()
+        users = [Usernew(firstname='User{}'.format(i), lastname='Load',
+                         email='user{}@example.com'.format(i), mobile=str(1000000000 + i),
+                         password='x', role='seller' if i % 2 else 'buyer',
+                         premium=i % 10 == 1) for i in range(args.users)]
+        db.session.add_all(users)
+        db.session.flush()
+        sellers = [user.id for user in users if user.role == 'seller']
+
+        products = []
+        for i in range(args.products):
+            product = Product(name='Product {}'.format(i), category=CATEGORIES[i % len(CATEGORIES)],
+                              description='Fresh produce item number {}'.format(i),
+                              user_id=sellers[i % len(sellers)], price=10.0 + i % 90,
+                              count=10 ** 9)
+            if random.random() < args.image_share:
+                product.image = imagestore.save(app.config['IMAGE_STORE'], random_png())
+            products.append(product)
+        db.session.add_all(products)
+
+        for i in range(args.orders):
+            order = Order(address='{} Main St'.format(i), city='City', state='State', pincode='12345')
+            for product in random.sample(products, random.randint(1, 3)):
+                order.items.append(OrderItem(product_name=product.name, quantity=random.randint(1, 5)))
+            db.session.add(order)
+
+        ids = [user.id for user in users]
+        for i in range(args.messages):
+            sender, receiver = random.sample(ids, 2)
+            db.session.add(ChatMessage(sender_id=sender, receiver_id=receiver,
+                                       message='Message {}'.format(i)))
+        db.session.commit()
+        return ids, sellers, [(product.id, product.name, product.user_id) for product in products]
+
+
+def scenarios(user_ids, sellers, products, image_share):
+    """(route, method) -> function returning (path, body, content type)."""
+    def listing():
+        return '/addproduct?limit=20&after={}'.format(random.randrange(len(products))), None, None
+
+    def add_product():
+        body = {'userId': random.choice(sellers), 'category': random.choice(CATEGORIES),
+                # A name per seller is created once, then updated.
+                'name': 'Load product {}'.format(random.randrange(200)),
+                'count': 5, 'description': 'Added under load', 'price': 25.0,
+                'offer': random.choice([0, 10]), 'offerDuration': 24}
+        if random.random() < image_share:
+            body['imageBinary'] = base64.b64encode(random_png()).decode()
+        return '/addproduct', json.dumps(body), 'application/json'
+
+    def place_order():
+        items = [{'product_id': product[0], 'quantity': 1}
+                 for product in random.sample(products, random.randint(1, 3))]
+        body = {'address': '1 Main St', 'city': 'City', 'state': 'State', 'pincode': '12345',
+                'items': items}
+        return '/placeorder', json.dumps(body), 'application/json'
+
+    def send_message():
+        sender, receiver = random.sample(user_ids, 2)
+        body = {'sender_id': sender, 'receiver_id': receiver, 'message': 'Load message'}
+        return '/chat', json.dumps(body), 'application/json'
+
+    def conversations():
+        return '/chat?sender_id={}'.format(random.choice(user_ids)), None, None
+
+    def seller_products():
+        return '/sellerproducts', urlencode({'userId': random.choice(sellers)}), \
+            'application/x-www-form-urlencoded'
+
+    def edit_product():
+        _, name, seller = random.choice(products)
+        body = {'userId': seller, 'name': name, 'count': 1, 'original_price': 30,
+                'discount': random.choice([0, 5, 10])}
+        return '/editproduct', urlencode(body), 'application/x-www-form-urlencoded'
+
+    return {
+        ('/addproduct', 'GET'): listing,
+        ('/addproduct', 'POST'): add_product,
+        ('/placeorder', 'POST'): place_order,
+        ('/chat', 'POST'): send_message,
+        ('/chat', 'GET'): conversations,
+        ('/sellerproducts', 'POST'): seller_products,
+        ('/editproduct', 'POST'): edit_product,
+    }
+
+
+def send(port, method, make):
+    path, body, content_type = make()
+    headers = {'Content-Type': content_type} if content_type else {}
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    start = time.perf_counter()
+    try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        ok = response.status < 500
+    except OSError:
+        ok = False
+    finally:
+        connection.close()
+    elapsed = (time.perf_counter() - start) * 1000
+    if ok and data.startswith(b'{'):
+        payload = json.loads(data)
+        ok = not (payload.get('Error') or payload.get('error'))
+    return elapsed, ok
+
+
+def query_totals(request_metrics, key):
+    """(statements, requests) recorded so far for a route."""
+    with request_metrics.lock:
+        histograms = request_metrics.histograms.get(key)
+        if histograms is None:
+            return 0, 0
+        counts = histograms[2]  # http_request_db_queries
+        return counts.sum, sum(counts.counts)
+
+
+def run_phase(port, method, make, clients, requests):
+    latencies = []
+    errors = [0]
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            elapsed, ok = send(port, method, make)
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))], 2)
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'mean_ms': round(statistics.mean(latencies), 2),
+    }
+
+
+def regressions(baseline, result, max_regression, min_delta_ms):
+    limit = 1 + max_regression / 100
+    problems = []
+    for name, now in result['routes'].items():
+        if now['errors']:
+            problems.append('{}: {} errors'.format(name, now['errors']))
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        if now['p95_ms'] > before['p95_ms'] * limit and now['p95_ms'] - before['p95_ms'] > min_delta_ms:
+            problems.append('{}: p95 {} ms -> {} ms'.format(name, before['p95_ms'], now['p95_ms']))
+        if now['throughput_rps'] * limit < before['throughput_rps']:
+            problems.append('{}: throughput {} -> {} req/s'.format(
+                name, before['throughput_rps'], now['throughput_rps']))
+        if now['queries_per_request'] > before['queries_per_request'] * limit:
+            problems.append('{}: {} -> {} queries per request'.format(
+                name, before['queries_per_request'], now['queries_per_request']))
+    return problems
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--image-share', type=float, default=0.2,
+                        help='fraction of products (and product posts) with an image')
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help='per route')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', help='also write the JSON here')
+    parser.add_argument('--baseline', help='JSON of an earlier run to compare with')
+    parser.add_argument('--max-regression', type=float, default=20.0, help='percent')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'load.db')
+    os.environ.setdefault('DB_POOL_SIZE', str(args.clients))
+    sys.path.insert(0, ROOT)
+    from app import app, image_variants, request_metrics
+    from serve import PooledWSGIServer
+
+    app.config['IMAGE_STORE'] = image_variants.root = os.path.join(workdir, 'images')
+    user_ids, sellers, products = seed(args)
+
+    server = PooledWSGIServer(('127.0.0.1', 0), args.clients)
+    server.set_app(app)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    result = {
+        'commit': git_commit(),
+        'config': {name: getattr(args, name) for name in (
+            'users', 'products', 'image_share', 'orders', 'messages', 'clients', 'requests', 'seed')},
+        'routes': {},
+    }
+    try:
+        for (rule, method), make in scenarios(user_ids, sellers, products, args.image_share).items():
+            run_phase(port, method, make, args.clients, args.clients)  # warm up
+            statements, requests = query_totals(request_metrics, (rule, method))
+            phase = run_phase(port, method, make, args.clients, args.requests)
+            after = query_totals(request_metrics, (rule, method))
+            served = after[1] - requests
+            phase['queries_per_request'] = round((after[0] - statements) / served, 2) if served else None
+            result['routes']['{} {}'.format(method, rule)] = phase
+    finally:
+        server.shutdown()
+        image_variants.shutdown()
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = regressions(baseline, result, args.max_regression, args.min_delta_ms)
+    else:
+        problems = regressions({'routes': {}}, result, args.max_regression, args.min_delta_ms)
+    for problem in problems:
+        print('REGRESSION ' + problem, file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Login throughput and catalog latency while logins are hashing.
+
+Runs --catalog threads reading /addproduct pages for --seconds, first
+alone and then next to --logins threads posting /login as fast as they
+can. Reports login throughput, how many logins were turned away with 503,
+and catalog p50/p99 latency in both phases. --workers 0 hashes on the
+request thread, as register/login did before the hashing pool.
+
+    python benchmarks/login_load.py --logins 8 --catalog 4 --seconds 5
+    python benchmarks/login_load.py --workers 0
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 2)
+
+
+def run(app, seconds, catalog_threads, login_threads, products):
+    stop = time.monotonic() + seconds
+    latencies = []
+    logins = {'ok': 0, 'busy': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def read_catalog():
+        client = app.test_client()
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            client.get('/addproduct?limit=20&after={}'.format(random.randrange(products)))
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    def log_in():
+        client = app.test_client()
+        while time.monotonic() < stop:
+            response = client.post('/login', json={'email': 'bench@example.com', 'password': 'secret'})
+            key = 'ok' if response.status_code == 200 else 'busy' if response.status_code == 503 else 'failed'
+            with lock:
+                logins[key] += 1
+            if response.status_code == 503:
+                time.sleep(0.01)
+
+    threads = [threading.Thread(target=read_catalog) for _ in range(catalog_threads)]
+    threads += [threading.Thread(target=log_in) for _ in range(login_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'logins_per_s': round(logins['ok'] / seconds, 1),
+        'logins_503': logins['busy'],
+        'logins_failed': logins['failed'],
+        'catalog_requests': len(latencies),
+        'catalog_p50_ms': percentile(latencies, 50),
+        'catalog_p99_ms': percentile(latencies, 99),
+        'catalog_mean_ms': round(statistics.mean(latencies), 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=8, help='login threads')
+    parser.add_argument('--catalog', type=int, default=4, help='catalog reader threads')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--workers', type=int, help='PASSWORD_HASH_WORKERS (default: the app default)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    if args.workers is not None:
+        os.environ['PASSWORD_HASH_WORKERS'] = str(args.workers)
+    sys.path.insert(0, ROOT)
+    from app import app, db, Usernew, Product, password_hasher
+
+    with app.app_context():
+        db.create_all()
+        seller = Usernew(firstname='Bench', lastname='Seller', email='bench@example.com',
+                         mobile='0000000000', password=password_hasher.hash('secret'), role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        db.session.add_all(Product(name='Product {}'.format(i), category='Fruits', description='d',
+                                   user_id=seller.id, price=1.5, count=100)
+                           for i in range(args.products))
+        db.session.commit()
+
+    print('hash method {}, {} hashing workers, {} logins x {} catalog threads, {} s'.format(
+        password_hasher.method, password_hasher.max_workers, args.logins, args.catalog, args.seconds))
+    header = '{:<16} {:>9} {:>6} {:>9} {:>8} {:>8}'
+    print(header.format('phase', 'logins/s', '503s', 'catalog', 'p50 ms', 'p99 ms'))
+    for phase, login_threads in (('catalog only', 0), ('with logins', args.logins)):
+        result = run(app, args.seconds, args.catalog, login_threads, args.products)
+        print(header.format(phase, result['logins_per_s'], result['logins_503'],
+                            result['catalog_requests'], result['catalog_p50_ms'],
+                            result['catalog_p99_ms']))
+    password_hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Overhead of the per-route metrics on the /addproduct listing.
+
+Times GET /addproduct through the test client with request metrics on and
+off, alternating request by request so drift affects both alike, and
+compares the median latencies:
+
+- uncached: the catalog cache is cleared before every request, so each
+  one runs its queries and serializes the page;
+- cached: served from the catalog cache, where the fixed per-request cost
+  of the metrics weighs most.
+
+Exits 1 when the uncached overhead exceeds --max-overhead percent.
+
+    python benchmarks/metrics_overhead.py --products 2000 --requests 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=2000, help='per setting')
+    parser.add_argument('--limit', type=int, default=100, help='page size')
+    parser.add_argument('--max-overhead', type=float, default=2.0, help='percent')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, ROOT)
+    from app import app, db, Usernew, Product, catalog_cache, request_metrics
+
+    with app.app_context():
+        db.create_all()
+        seller = Usernew(firstname='Bench', lastname='Seller', email='bench@example.com',
+                         mobile='0000000000', password='x', role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        db.session.add_all(Product(
+            name='Product {}'.format(i), category='Fruits', description='Item {}'.format(i),
+            user_id=seller.id, price=1.5, count=100) for i in range(args.products))
+        db.session.commit()
+
+    client = app.test_client()
+    url = '/addproduct?limit={}'.format(args.limit)
+
+    def timed(enabled, cached):
+        request_metrics.enabled = enabled
+        if not cached:
+            catalog_cache.clear()
+        start = time.perf_counter()
+        client.get(url)
+        return (time.perf_counter() - start) * 1000
+
+    results = {}
+    for cached in (False, True):
+        client.get(url)
+        timings = {True: [], False: []}
+        for i in range(args.requests):
+            # Alternate which setting goes first.
+            for enabled in ((False, True) if i % 2 else (True, False)):
+                timings[enabled].append(timed(enabled, cached))
+        off, on = statistics.median(timings[False]), statistics.median(timings[True])
+        results[cached] = (on - off) / off * 100
+        print('{:<9} off {:.3f} ms  on {:.3f} ms  overhead {:+.2f}%'.format(
+            'cached' if cached else 'uncached', off, on, results[cached]))
+    request_metrics.enabled = True
+
+    if results[False] > args.max_overhead:
+        print('Uncached overhead above {}%'.format(args.max_overhead))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Serialization cost of a product listing.
+
+Times turning the rows of a /addproduct query into JSON bytes:
+
+- the previous approach: a dict per row built by column name, then
+  Flask's jsonify (stdlib json);
+- serializers.Schema.dump with the stdlib encoder;
+- serializers.Schema.dump with orjson (if installed).
+
+    python benchmarks/serialization.py --products 10000 --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, ROOT)
+    import serializers
+    from app import app, db, Usernew, Product, catalog_query, product_schema
+    from datetime import datetime
+    from flask import jsonify
+
+    with app.app_context():
+        db.create_all()
+        seller = Usernew(firstname='Bench', lastname='Seller', email='bench@example.com',
+                         mobile='0000000000', password='x', role='seller', premium=True)
+        db.session.add(seller)
+        db.session.flush()
+        db.session.add_all(Product(
+            name='Product {}'.format(i), category='Fruits', description='Item {}'.format(i),
+            user_id=seller.id, price=1.5, count=100, offer_expiration=datetime.utcnow())
+            for i in range(args.products))
+        db.session.commit()
+
+    # Image URLs need url_for and are the same work for every approach.
+    fields = [key for key in product_schema.keys() if not key.startswith('image')]
+    with app.test_request_context('/addproduct'):
+        rows = catalog_query(fields).all()
+
+        def by_name_jsonify():
+            return jsonify([{f: row._mapping[f] for f in fields} for row in rows]).get_data()
+
+        def schema_with(dumps):
+            return lambda: dumps(product_schema.dump(rows, fields))
+
+        def stdlib_dumps(obj):
+            return json.dumps(obj, default=serializers.default, separators=(',', ':')).encode()
+
+        results = [('dict by name + jsonify', timed(by_name_jsonify, args.repeat)),
+                   ('Schema.dump + json', timed(schema_with(stdlib_dumps), args.repeat))]
+        if serializers.orjson is not None:
+            results.append(('Schema.dump + orjson', timed(schema_with(serializers.dumps), args.repeat)))
+
+    print('{} rows, median of {} runs'.format(len(rows), args.repeat))
+    for name, ms in results:
+        print('{:<26} {:>8.2f} ms'.format(name, ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Requests per second and latency: debug server vs. serve.py modes.
+
+Seeds a temporary SQLite catalog, starts the app once per mode in a
+subprocess, and drives it over HTTP with --clients threads for --seconds
+against a mix of catalog routes (listing pages, category pages, product
+detail, search). Modes whose server package is not installed are skipped.
+
+    python benchmarks/serving.py --clients 32 --seconds 10
+    python benchmarks/serving.py --modes dev threaded --workers 4 --threads 16
+
+"dev" is how app.py runs today: app.run(debug=True), without the reloader.
+"""
+import argparse
+import http.client
+import importlib.util
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(database_url, products):
+    os.environ['DATABASE_URL'] = database_url
+    sys.path.insert(0, ROOT)
+    from app import app, db, Usernew, Product
+    with app.app_context():
+        db.create_all()
+        seller = Usernew(firstname='Bench', lastname='Seller', email='bench@example.com',
+                         mobile='0000000000', password='x', role='seller', premium=True)
+        db.session.add(seller)
+        db.session.flush()
+        db.session.add_all(Product(
+            name='Product {}'.format(i), category='Category {}'.format(i % 20),
+            description='Fresh produce item number {}'.format(i), user_id=seller.id,
+            price=1.5, count=100) for i in range(products))
+        db.session.commit()
+        db.engine.dispose()
+
+
+def command(mode, port, args):
+    if mode == 'dev':
+        return [sys.executable, '-c',
+                'from app import app; app.run(port={}, debug=True, use_reloader=False)'.format(port)]
+    return [sys.executable, 'serve.py', '--server', mode, '--port', str(port),
+            '--workers', str(args.workers), '--threads', str(args.threads)]
+
+
+def available(mode):
+    needs = {'gunicorn': ['gunicorn'], 'asgi': ['uvicorn', 'a2wsgi']}.get(mode, [])
+    return all(importlib.util.find_spec(name) for name in needs)
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server on port {} did not start'.format(port))
+
+
+def paths(products):
+    return [
+        lambda: '/addproduct?limit=20&after={}'.format(random.randrange(products)),
+        lambda: '/products/Category%20{}?limit=20'.format(random.randrange(20)),
+        lambda: '/product-detail/{}'.format(random.randrange(1, products)),
+        lambda: '/search?q=item+{}'.format(random.randrange(products)),
+    ]
+
+
+def drive(port, clients, seconds, products):
+    routes = paths(products)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def client():
+        while time.monotonic() < stop:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            start = time.perf_counter()
+            try:
+                connection.request('GET', random.choice(routes)(),
+                                   headers={'Accept-Encoding': 'gzip'})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 500
+            except OSError:
+                ok = False
+            finally:
+                connection.close()
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))], 1)
+    return {
+        'req_s': round(len(latencies) / seconds, 1),
+        'p50_ms': pct(50) if latencies else None,
+        'p99_ms': pct(99) if latencies else None,
+        'mean_ms': round(statistics.mean(latencies), 1) if latencies else None,
+        'errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['dev', 'threaded', 'gunicorn', 'asgi'])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database_url = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    seed(database_url, args.products)
+    env = dict(os.environ, DATABASE_URL=database_url)
+
+    print('{} products, {} clients, {} s per mode, {} workers x {} threads'.format(
+        args.products, args.clients, args.seconds, args.workers, args.threads))
+    header = '{:<10} {:>9} {:>8} {:>8} {:>8} {:>7}'
+    print(header.format('mode', 'req/s', 'p50 ms', 'p99 ms', 'mean ms', 'errors'))
+    for mode in args.modes:
+        if not available(mode):
+            print('{:<10} skipped (not installed)'.format(mode))
+            continue
+        server = subprocess.Popen(command(mode, args.port, args), cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            drive(args.port, args.clients, 1, args.products)  # warm up caches and pools
+            result = drive(args.port, args.clients, args.seconds, args.products)
+        finally:
+            server.terminate()
+            server.wait()
+        print(header.format(mode, result['req_s'], result['p50_ms'], result['p99_ms'],
+                            result['mean_ms'], result['errors']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Read-through cache for serialized catalog responses.
+
+Entries hold the response body as bytes plus the few headers that go with
+it, and carry tags ('catalog', 'category:<name>', 'product:<id>') so writes
+can invalidate exactly the listings they affect.
+
+``MemoryBackend`` is an in-process LRU with a per-entry TTL and a cap on the
+total size of the cached bodies. ``RedisBackend`` stores entries in a
+Redis-compatible server shared by all workers; expiry uses Redis TTLs and
+memory limits are left to the server's maxmemory policy.
+
+The cache also owns the catalog version, a counter bumped on every catalog
+write and used as the ETag of catalog responses. The Redis version is
+shared by all workers. The in-process one only sees this worker's writes,
+so its ETags also carry the current TTL period and lapse with it. A fill made with the
+version read before the view ran is dropped if a write bumped it since, so
+rows read before an invalidation are never stored after it.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Only needed with a redis:// CATALOG_CACHE_URL.
+    redis = None
+
+
+class MemoryBackend:
+    shared = False
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires, value, tags, size)
+        self.tags = {}  # tag -> set of keys
+        self.size = 0
+        self.lock = threading.Lock()
+        self.evictions = 0
+        # Versions from different processes must never look alike.
+        self.version_prefix = uuid.uuid4().hex[:8]
+        self.version_counter = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.evictions += 1
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags, ttl, version=None):
+        size = len(value[0])
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if version is not None and version != self.version():
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + ttl, value, tags, size)
+            self.size += size
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        with self.lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self.tags.get(tag, ()))
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+            self.size = 0
+
+    def _drop(self, key):
+        _, _, tags, size = self.entries.pop(key)
+        self.size -= size
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def version(self):
+        return '{}-{}'.format(self.version_prefix, self.version_counter)
+
+    def bump_version(self):
+        with self.lock:
+            self.version_counter += 1
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.size,
+                'evictions': self.evictions}
+
+
+class RedisBackend:
+    prefix = 'catalog-cache:'
+    shared = True
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('The redis package is required for {}'.format(url))
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        headers_length = int.from_bytes(raw[:4], 'big')
+        headers = json.loads(raw[4:4 + headers_length])
+        return raw[4 + headers_length:], headers
+
+    def set(self, key, value, tags, ttl, version=None):
+        body, headers = value
+        encoded = json.dumps(headers).encode()
+        pipe = self.client.pipeline()
+        if version is not None:
+            # A bump between the check and EXEC aborts the transaction.
+            pipe.watch(self.prefix + 'version')
+            if self.version() != version:
+                pipe.reset()
+                return
+            pipe.multi()
+        pipe.set(self.prefix + key, len(encoded).to_bytes(4, 'big') + encoded + body, ex=int(ttl))
+        for tag in tags:
+            pipe.sadd(self.prefix + 'tag:' + tag, key)
+            pipe.expire(self.prefix + 'tag:' + tag, int(ttl))
+        try:
+            pipe.execute()
+        except redis.WatchError:
+            pass
+
+    def invalidate(self, tags):
+        tag_keys = [self.prefix + 'tag:' + tag for tag in tags]
+        keys = set(self.client.sunion(tag_keys)) if tag_keys else set()
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.delete(self.prefix + key.decode())
+        pipe.delete(*tag_keys)
+        pipe.execute()
+        return len(keys)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def version(self):
+        return 'r-{}'.format(int(self.client.get(self.prefix + 'version') or 0))
+
+    def bump_version(self):
+        self.client.incr(self.prefix + 'version')
+
+    def stats(self):
+        return {'evictions': self.client.info('stats').get('evicted_keys', 0)}
+
+
+class CatalogCache:
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_url(cls, url=None, ttl=60, max_bytes=64 * 1024 * 1024):
+        if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+            return cls(RedisBackend(url), ttl)
+        return cls(MemoryBackend(max_bytes), ttl)
+
+    def get(self, key):
+        """Returns ``(body, headers)`` or None."""
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, body, headers, tags, version=None):
+        """Stores an entry, unless ``version`` is given and no longer current."""
+        self.backend.set(key, (body, headers), tags, self.ttl, version)
+
+    def invalidate(self, tags):
+        # Bump first: a fill that checks the version after this is refused,
+        # and one stored before it is dropped below.
+        self.backend.bump_version()
+        self.invalidations += self.backend.invalidate(tags)
+
+    def version(self):
+        return self.backend.version()
+
+    def etag_version(self):
+        """The version as used in ETags, valid for at most ``ttl`` when not shared."""
+        if self.backend.shared:
+            return self.backend.version()
+        return '{}.{}'.format(self.backend.version(), int(time.time() // self.ttl))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        stats = {'hits': self.hits, 'misses': self.misses,
+                 'invalidations': self.invalidations}
+        stats.update(self.backend.stats())
+        return stats
@@ -0,0 +1,98 @@
+"""Database engine settings read from the environment.
+
+``DATABASE_URL`` picks the database; it defaults to SQLite in the instance
+folder and also accepts PostgreSQL (``postgres://`` URLs as handed out by
+most hosts are rewritten to ``postgresql://``). The other variables tune
+the engine and all have defaults meant for a single host:
+
+SQLite, applied to every new connection:
+
+    SQLITE_JOURNAL_MODE   wal        readers no longer block the writer
+    SQLITE_SYNCHRONOUS    normal     fsync at checkpoints only; safe in WAL
+    SQLITE_BUSY_TIMEOUT   5000       ms a writer waits for the lock before
+                                     failing with "database is locked"
+    SQLITE_MMAP_SIZE      268435456  bytes of the file read through mmap
+    SQLITE_CACHE_SIZE     -65536     page cache; negative values are KiB
+
+Connection pool, for file databases and servers alike:
+
+    DB_POOL_SIZE          5
+    DB_MAX_OVERFLOW       10
+    DB_POOL_TIMEOUT       30         seconds to wait for a free connection
+    DB_POOL_RECYCLE       1800       seconds before a connection is replaced
+    DB_POOL_PRE_PING      on for server databases, off for SQLite
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+SQLITE_PRAGMAS = (
+    # (pragma, variable, default)
+    ('journal_mode', 'SQLITE_JOURNAL_MODE', 'wal'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS', 'normal'),
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT', '5000'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE', '268435456'),
+    ('cache_size', 'SQLITE_CACHE_SIZE', '-65536'),
+)
+
+
+def env_flag(environ, name, default):
+    value = environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_url(name='DATABASE_URL', default='sqlite:///users.db', environ=os.environ):
+    url = environ.get(name) or default
+    if url and url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_memory_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(url, environ=os.environ):
+    """``SQLALCHEMY_ENGINE_OPTIONS`` for ``url``."""
+    if is_memory_sqlite(url):
+        # One shared connection; there is no pool to size.
+        return {}
+    sqlite = make_url(url).get_backend_name() == 'sqlite'
+    return {
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': env_flag(environ, 'DB_POOL_PRE_PING', not sqlite),
+    }
+
+
+def sqlite_pragmas(environ=os.environ):
+    pragmas = []
+    for pragma, name, default in SQLITE_PRAGMAS:
+        value = environ.get(name, default)
+        if value != '':
+            pragmas.append((pragma, value))
+    return pragmas
+
+
+def install(engine, environ=os.environ):
+    """Runs the SQLite PRAGMAs on each connection ``engine`` opens.
+
+    Does nothing for other databases. Must be called before the engine
+    hands out its first connection.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(environ)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas:
+            cursor.execute('PRAGMA {}={}'.format(pragma, value))
+        cursor.close()
@@ -0,0 +1,174 @@
+"""Content-addressed file store for product images.
+
+Uploads are decoded once and written to ``<root>/<aa>/<sha256>``, where ``aa``
+is the first two hex digits of the digest. The ``Product.image`` column only
+keeps the digest, so identical uploads share one file and a digest can be
+served with a strong ETag and cached forever by browsers.
+"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it only originals are served.
+    Image = None
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Responsive variants generated for every uploaded image.
+VARIANT_WIDTHS = (160, 320, 800)
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+# Magic bytes of the formats browsers can upload through <input type=file>.
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+]
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def is_digest(value):
+    return isinstance(value, str) and DIGEST_RE.match(value) is not None
+
+
+def decode_upload(value, max_bytes=None):
+    """Returns the raw bytes of a data URL or bare base64 string.
+
+    Raises ``ImageTooLarge`` when they would exceed ``max_bytes``; that is
+    checked on the encoded length, before anything is decoded.
+    """
+    if value.startswith('data:'):
+        header, _, value = value.partition(',')
+        if not header.endswith(';base64'):
+            raise ValueError('Image data URL must be base64 encoded')
+    if max_bytes is not None and (len(value.rstrip('=')) * 3) // 4 > max_bytes:
+        raise ImageTooLarge('Image larger than {} bytes'.format(max_bytes))
+    try:
+        return base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise ValueError('Invalid image data')
+
+
+def path_for(root, digest):
+    return os.path.join(root, digest[:2], digest)
+
+
+def variant_path(root, digest, width, fmt):
+    return os.path.join(root, digest[:2], '{}.w{}.{}'.format(digest, width, fmt))
+
+
+def write_atomic(path, write):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so readers never see a partial image.
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            write(tmp)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def digest_of(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def save(root, data):
+    """Writes ``data`` to the store (if not already there) and returns its digest."""
+    digest = digest_of(data)
+    path = path_for(root, digest)
+    if os.path.exists(path):
+        return digest
+
+    write_atomic(path, lambda f: f.write(data))
+    return digest
+
+
+def sniff_mimetype(path):
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mimetype in SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    return 'application/octet-stream'
+
+
+def generate_variants(root, digest):
+    """Renders every missing width/format variant of a stored image.
+
+    Runs in a worker process. Existing variants are left alone, so calling
+    it again for the same digest is cheap and safe.
+    """
+    missing = [(width, fmt) for width in VARIANT_WIDTHS for fmt in VARIANT_FORMATS
+               if not os.path.exists(variant_path(root, digest, width, fmt))]
+    if not missing:
+        return 0
+
+    with Image.open(path_for(root, digest)) as original:
+        original = original.convert('RGB')
+        for width, fmt in missing:
+            # Never upscale: small originals are re-encoded at their own size.
+            variant = original
+            if original.width > width:
+                height = round(original.height * width / original.width)
+                variant = original.resize((width, height), Image.LANCZOS)
+            write_atomic(variant_path(root, digest, width, fmt),
+                         lambda f: variant.save(f, VARIANT_FORMATS[fmt], quality=80))
+    return len(missing)
+
+
+class VariantPipeline:
+    """Generates image variants on a process pool, off the request thread.
+
+    A digest already queued or being rendered is not submitted twice.
+    """
+
+    def __init__(self, root, max_workers=2):
+        self.root = root
+        self.max_workers = max_workers
+        self.executor = None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def submit(self, digest):
+        if not self.enabled:
+            return None
+        with self.lock:
+            if digest in self.pending:
+                return None
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self.pending.add(digest)
+        future = self.executor.submit(generate_variants, self.root, digest)
+        future.add_done_callback(lambda _: self.discard(digest))
+        return future
+
+    def discard(self, digest):
+        with self.lock:
+            self.pending.discard(digest)
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
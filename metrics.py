@@ -0,0 +1,171 @@
+"""Per-route request metrics in the Prometheus text format.
+
+For every request, ``RequestMetrics`` records under the matched URL rule
+(e.g. ``/product-detail/<int:product_id>``):
+
+- latency, as a histogram;
+- response size in bytes, as sent (after compression);
+- the number of SQL statements it ran and how long each took, timed with
+  SQLAlchemy's before/after_cursor_execute events (failed ones via handle_error);
+- a request counter by status code.
+
+``render`` returns everything for a /metrics endpoint. Values are kept per
+process; with several workers each serves its own.
+
+Statements slower than ``slow_query_ms`` are logged with their bind
+parameters on the ``sql.slow`` logger. Off unless a threshold is set.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_query_logger = logging.getLogger('sql.slow')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last: above the largest bucket
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative)
+        cumulative += self.counts[-1]
+        yield '{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, labels, round(self.sum, 6))
+        yield '{}_count{{{}}} {}'.format(name, labels, cumulative)
+
+
+FAMILIES = (
+    # (name, type, help, buckets)
+    ('http_request_duration_seconds', 'histogram', 'Request latency.', LATENCY_BUCKETS),
+    ('http_response_size_bytes', 'histogram', 'Response body size as sent.', SIZE_BUCKETS),
+    ('http_request_db_queries', 'histogram', 'SQL statements per request.', COUNT_BUCKETS),
+    ('db_query_duration_seconds', 'histogram', 'Duration of each SQL statement.', QUERY_BUCKETS),
+)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestMetrics:
+    def __init__(self, app=None, slow_query_ms=None):
+        self.slow_query_ms = slow_query_ms
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.histograms = {}  # (route, method) -> one Histogram per family
+        self.requests = {}  # (route, method, status) -> count
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        # Every engine, including binds created later.
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(Engine, 'handle_error', self.handle_error)
+
+    def start_request(self):
+        if self.enabled:
+            g.metrics_start = time.perf_counter()
+            g.metrics_queries = []
+
+    def finish_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        queries = g.pop('metrics_queries')
+        rule = request.url_rule
+        key = (rule.rule if rule is not None else '<unmatched>', request.method)
+        # Streams are not consumed to be measured: files report their
+        # Content-Length, chat streams 0.
+        if response.is_sequence:
+            size = response.calculate_content_length()
+        else:
+            size = response.content_length or 0
+        with self.lock:
+            histograms = self.histograms.get(key)
+            if histograms is None:
+                histograms = self.histograms[key] = [Histogram(f[3]) for f in FAMILIES]
+            latency, sizes, counts, durations = histograms
+            latency.observe(elapsed)
+            sizes.observe(size)
+            counts.observe(len(queries))
+            for duration in queries:
+                durations.observe(duration)
+            counter = key + (response.status_code,)
+            self.requests[counter] = self.requests.get(counter, 0) + 1
+        return response
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.enabled:
+            return
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def finish_query(self, conn):
+        """Pops the statement's start time and counts it for the request."""
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return None
+        duration = time.perf_counter() - starts.pop()
+        try:
+            queries = g.get('metrics_queries')
+        except RuntimeError:  # Outside an app context.
+            queries = None
+        if queries is not None:
+            queries.append(duration)
+        return duration
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = self.finish_query(conn)
+        if duration is None:
+            return
+        if self.slow_query_ms is not None and duration * 1000 >= self.slow_query_ms:
+            slow_query_logger.warning('%.1f ms %s %s', duration * 1000, statement,
+                                      parameters if not executemany else '<{} rows>'.format(len(parameters)))
+
+    def handle_error(self, exception_context):
+        # A failed statement gets no after_cursor_execute; without this its
+        # start would stay on the connection's stack and skew later timings.
+        if exception_context.connection is not None:
+            self.finish_query(exception_context.connection)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            requests = sorted(self.requests.items())
+        lines = ['# HELP http_requests_total Requests by route, method and status.',
+                 '# TYPE http_requests_total counter']
+        for (route, method, status), count in requests:
+            lines.append('http_requests_total{{route="{}",method="{}",status="{}"}} {}'.format(
+                escape(route), method, status, count))
+        for index, (name, kind, help, _) in enumerate(FAMILIES):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for (route, method), family in histograms:
+                labels = 'route="{}",method="{}"'.format(escape(route), method)
+                lines.extend(family[index].lines(name, labels))
+        return '\n'.join(lines) + '\n'
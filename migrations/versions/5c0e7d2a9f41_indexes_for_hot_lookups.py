@@ -0,0 +1,52 @@
+"""indexes for hot lookups
+
+Revision ID: 5c0e7d2a9f41
+Revises: 22b155e31fc4
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0e7d2a9f41'
+down_revision = '22b155e31fc4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The unique (user_id, name) index also covers lookups by user_id alone
+    # and the (name, user_id) equality lookups in add_product/editproduct.
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT user_id, name FROM product GROUP BY user_id, name HAVING count(*) > 1'
+    )).fetchall()
+    if duplicates:
+        raise RuntimeError(
+            'Merge duplicate products before upgrading: {}'.format(duplicates))
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index('ix_product_category', ['category'], unique=False)
+        batch_op.create_index('uq_product_user_id_name', ['user_id', 'name'], unique=True)
+
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_message_sender_receiver_timestamp',
+                              ['sender_id', 'receiver_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_chat_message_receiver_id', ['receiver_id'], unique=False)
+
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.create_index('ix_order_item_order_id', ['order_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_item_order_id')
+
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_message_receiver_id')
+        batch_op.drop_index('ix_chat_message_sender_receiver_timestamp')
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('uq_product_user_id_name')
+        batch_op.drop_index('ix_product_category')
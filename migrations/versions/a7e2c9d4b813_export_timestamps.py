@@ -0,0 +1,41 @@
+"""export timestamps
+
+Revision ID: a7e2c9d4b813
+Revises: 8d4b1f6e3a27
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e2c9d4b813'
+down_revision = '8d4b1f6e3a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_product_updated_at', ['updated_at'], unique=False)
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_order_created_at', ['created_at'], unique=False)
+
+    # Existing rows count as changed now, so the first incremental sync
+    # after the upgrade picks them all up.
+    op.execute(sa.text('UPDATE product SET updated_at = CURRENT_TIMESTAMP'))
+    op.execute(sa.text('UPDATE "order" SET created_at = CURRENT_TIMESTAMP'))
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_created_at')
+        batch_op.drop_column('created_at')
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_updated_at')
+        batch_op.drop_column('updated_at')
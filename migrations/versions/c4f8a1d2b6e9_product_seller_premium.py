@@ -0,0 +1,45 @@
+"""product seller_premium
+
+Revision ID: c4f8a1d2b6e9
+Revises: a7e2c9d4b813
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f8a1d2b6e9'
+down_revision = 'a7e2c9d4b813'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('seller_premium', sa.Boolean(), nullable=False,
+                                      server_default=sa.false()))
+
+    # Copy each seller's flag in id ranges, so no single statement locks or
+    # rewrites the whole table.
+    product = sa.table('product', sa.column('id', sa.Integer),
+                       sa.column('user_id', sa.Integer),
+                       sa.column('seller_premium', sa.Boolean))
+    usernew = sa.table('usernew', sa.column('id', sa.Integer),
+                       sa.column('premium', sa.Boolean))
+    premium = sa.select(usernew.c.premium).where(
+        usernew.c.id == product.c.user_id).scalar_subquery()
+    bind = op.get_bind()
+    last_id = bind.execute(sa.select(sa.func.max(product.c.id))).scalar() or 0
+    for start in range(0, last_id, BACKFILL_BATCH_SIZE):
+        bind.execute(product.update().where(
+            product.c.id > start, product.c.id <= start + BACKFILL_BATCH_SIZE
+        ).values(seller_premium=sa.func.coalesce(premium, sa.false())))
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_column('seller_premium')
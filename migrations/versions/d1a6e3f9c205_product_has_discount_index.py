@@ -0,0 +1,26 @@
+"""product hasDiscount index
+
+Revision ID: d1a6e3f9c205
+Revises: c4f8a1d2b6e9
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1a6e3f9c205'
+down_revision = 'c4f8a1d2b6e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index('ix_product_has_discount', ['hasDiscount'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_has_discount')
@@ -0,0 +1,28 @@
+"""widen usernew password
+
+Revision ID: e8b3f5a7c190
+Revises: d1a6e3f9c205
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b3f5a7c190'
+down_revision = 'd1a6e3f9c205'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('usernew', schema=None) as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=120),
+                              type_=sa.String(length=255), existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('usernew', schema=None) as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=255),
+                              type_=sa.String(length=120), existing_nullable=False)
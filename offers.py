@@ -0,0 +1,86 @@
+"""Expires product offers at the moment they lapse.
+
+``ExpiryScheduler`` keeps a min-heap of (expires_at, product id) and a
+background thread that sleeps until the earliest entry is due, then hands
+all due ids to ``expire`` in batches. Writes that set an offer call
+``schedule``; a periodic ``load`` of the offers ending within the next
+refresh interval picks up offers written by other processes or by raw SQL.
+
+An entry whose product was rescheduled since it was pushed is skipped, and
+``expire`` is expected to check the stored expiry itself, so running a
+scheduler in every worker is safe.
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    def __init__(self, load, expire, refresh=300, batch_size=500):
+        self.load = load  # load(until) -> iterable of (product id, expires_at)
+        self.expire = expire  # expire(ids, now) -> number of offers expired
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.heap = []
+        self.scheduled = {}  # product id -> expiry of its latest heap entry
+        self.condition = threading.Condition()
+        self.thread = None
+        self.expired = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='offer-expiry', daemon=True)
+                self.thread.start()
+
+    def schedule(self, product_id, expires_at):
+        with self.condition:
+            if self.scheduled.get(product_id) == expires_at:
+                return
+            self.scheduled[product_id] = expires_at
+            heapq.heappush(self.heap, (expires_at, product_id))
+            if self.heap[0] == (expires_at, product_id):
+                # New earliest entry: wake the thread to shorten its sleep.
+                self.condition.notify()
+
+    def due(self, now):
+        """Pops the ids whose latest entry is at or before ``now``."""
+        ids = []
+        while self.heap and self.heap[0][0] <= now:
+            expires_at, product_id = heapq.heappop(self.heap)
+            if self.scheduled.get(product_id) == expires_at:
+                del self.scheduled[product_id]
+                ids.append(product_id)
+        return ids
+
+    def run(self):
+        next_load = 0
+        while True:
+            if time.monotonic() >= next_load:
+                next_load = time.monotonic() + self.refresh
+                try:
+                    for product_id, expires_at in self.load(
+                            datetime.utcnow() + timedelta(seconds=2 * self.refresh)):
+                        self.schedule(product_id, expires_at)
+                except Exception:
+                    logger.exception('Loading offer expirations failed')
+            now = datetime.utcnow()
+            with self.condition:
+                ids = self.due(now)
+                if not ids:
+                    timeout = next_load - time.monotonic()
+                    if self.heap:
+                        timeout = min(timeout, (self.heap[0][0] - now).total_seconds())
+                    self.condition.wait(max(timeout, 0))
+                    continue
+            for start in range(0, len(ids), self.batch_size):
+                try:
+                    self.expired += self.expire(ids[start:start + self.batch_size], now)
+                except Exception:
+                    logger.exception('Expiring offers failed')
@@ -0,0 +1,125 @@
+"""Password hashing off the request thread.
+
+Hashes are computed on a small process pool so a burst of logins cannot
+tie up the request threads' CPU. At most ``max_pending`` hashes may be
+queued or running; beyond that ``hash``/``verify`` raise ``Busy`` straight
+away and the caller answers 503 instead of letting requests pile up.
+``max_workers=0`` hashes inline, which is simpler for development.
+
+``method`` is any Werkzeug method (``scrypt:n:r:p``, ``pbkdf2:sha256:it``)
+or ``argon2:time_cost:memory_cost:parallelism`` when argon2-cffi is
+installed. Hashes made with other settings still verify:
+
+- the plain ``sha256$salt$hex`` hashes older Werkzeug versions produced
+  for ``method='sha256'``, which current Werkzeug rejects;
+- Werkzeug hashes with other parameters, and argon2 hashes.
+
+``needs_rehash`` tells the caller to replace such a hash after a
+successful login.
+"""
+import hashlib
+import hmac
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    import argon2
+except ImportError:  # Only needed for argon2 methods.
+    argon2 = None
+
+
+class Busy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+def argon2_hasher(method):
+    if argon2 is None:
+        raise RuntimeError('The argon2-cffi package is required for {}'.format(method))
+    params = [int(value) for value in method.split(':')[1:]]
+    return argon2.PasswordHasher(*params)
+
+
+def hash_password(method, password):
+    if method.startswith('argon2'):
+        return argon2_hasher(method).hash(password)
+    return generate_password_hash(password, method=method)
+
+
+def verify_password(method, stored, password):
+    if stored.startswith('$argon2'):
+        try:
+            return argon2_hasher(method if method.startswith('argon2') else 'argon2').verify(
+                stored, password)
+        except argon2.exceptions.VerificationError:
+            return False
+    if stored.startswith('sha256$'):
+        # Legacy: hmac(salt, password) as written by Werkzeug < 2.3.
+        _, salt, digest = stored.split('$', 2)
+        expected = hmac.new(salt.encode(), password.encode(), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, digest)
+    return check_password_hash(stored, password)
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt:32768:8:1', max_workers=2, max_pending=32, timeout=10):
+        self.method = method
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.prefix = None
+        self.executor = None
+        self.pending = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        if method.startswith('argon2'):
+            argon2_hasher(method)
+
+    def hash(self, password):
+        return self._run(hash_password, self.method, password)
+
+    def verify(self, stored, password):
+        if not stored:
+            return False
+        return self._run(verify_password, self.method, stored, password)
+
+    def needs_rehash(self, stored):
+        if self.method.startswith('argon2'):
+            return not stored.startswith('$argon2') or argon2_hasher(self.method).check_needs_rehash(stored)
+        if self.prefix is None:
+            # Werkzeug fills in defaults ('scrypt' -> 'scrypt:32768:8:1'), so
+            # compare against what the method actually writes.
+            self.prefix = hash_password(self.method, '').split('$', 1)[0]
+        return stored.split('$', 1)[0] != self.prefix
+
+    def _run(self, fn, *args):
+        if not self.max_workers:
+            return fn(*args)
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise Busy()
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self.pending += 1
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise Busy()
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def stats(self):
+        return {'pending': self.pending, 'rejected': self.rejected,
+                'workers': self.max_workers, 'method': self.method}
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,104 @@
+"""In-process cache of user profiles.
+
+Logged-in requests, /usernew and the chat routes all turn user ids into the
+same few columns. ``ProfileCache`` keeps them as immutable ``Profile``
+records for ``ttl`` seconds, evicting the least recently used once it holds
+``max_entries``. Writes to a user invalidate their entry; the TTL bounds how
+long another worker can serve the old values.
+
+``Profile`` also implements the attributes Flask-Login expects of a user,
+so ``load_user`` can return it as ``current_user``. It carries no password
+hash.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class Profile:
+    __slots__ = ('id', 'firstname', 'lastname', 'email', 'role', 'premium')
+
+    def __init__(self, id, firstname, lastname, email, role, premium):
+        for name, value in zip(self.__slots__, (id, firstname, lastname, email, role, bool(premium))):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Profile is immutable')
+
+    def __repr__(self):
+        return '<Profile {}>'.format(self.id)
+
+    # Flask-Login user interface.
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def get_id(self):
+        return str(self.id)
+
+
+class ProfileCache:
+    def __init__(self, load, ttl=60, max_entries=10000):
+        self.load = load  # load(ids) -> iterable of Profile
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # id -> (expires, Profile)
+        self.lock = threading.Lock()
+        # Bumped by invalidate(); a load that raced one is not stored.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        return self.get_many([user_id]).get(int(user_id))
+
+    def get_many(self, ids):
+        """``{id: Profile}`` for the ids that exist; one load for all misses."""
+        ids = {int(user_id) for user_id in ids}
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            for user_id in ids:
+                entry = self.entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self.entries.move_to_end(user_id)
+                    found[user_id] = entry[1]
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+            generation = self.generation
+        missing = ids - found.keys()
+        if missing:
+            loaded = {profile.id: profile for profile in self.load(missing)}
+            found.update(loaded)
+            with self.lock:
+                if generation != self.generation:
+                    return found
+                expires = time.monotonic() + self.ttl
+                for user_id, profile in loaded.items():
+                    self.entries[user_id] = (expires, profile)
+                    self.entries.move_to_end(user_id)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return found
+
+    def invalidate(self, ids):
+        with self.lock:
+            self.generation += 1
+            for user_id in ids:
+                if self.entries.pop(int(user_id), None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'entries': len(self.entries), 'evictions': self.evictions,
+                'invalidations': self.invalidations}
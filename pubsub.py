@@ -0,0 +1,129 @@
+"""Publish/subscribe hub used to push new chat messages to open streams.
+
+Subscribers are local queues. How a published message reaches them depends
+on the backend:
+
+- ``MemoryBackend`` delivers in-process. Enough for a single worker.
+- ``RedisBackend`` goes through a Redis-compatible broker, so a message sent
+  on one worker reaches streams held open by the others. Each process keeps
+  one broker subscription and fans out locally.
+
+The backend is started on first use in each process rather than when the
+hub is created: the app is imported before the server forks its workers,
+and the broker's listener thread would not survive the fork.
+"""
+import json
+import os
+import queue
+import threading
+
+try:
+    import redis
+except ImportError:  # Only needed with a redis:// CHAT_PUBSUB_URL.
+    redis = None
+
+
+class Subscription:
+    def __init__(self, hub, channel, maxsize):
+        self.hub = hub
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # A stalled client must not block publishers; it resumes from
+            # its last event id when it reconnects.
+            self.close()
+
+    def get(self, timeout=None):
+        """Next message, or None when ``timeout`` expires first."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.hub.unsubscribe(self)
+
+
+class MemoryBackend:
+    def start(self, hub):
+        self.hub = hub
+
+    def publish(self, channel, message):
+        self.hub.deliver(channel, message)
+
+
+class RedisBackend:
+    prefix = 'pubsub:'
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('The redis package is required for {}'.format(url))
+        self.client = redis.Redis.from_url(url)
+
+    def start(self, hub):
+        self.hub = hub
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(**{self.prefix + '*': self.on_message})
+        self.thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def on_message(self, event):
+        channel = event['channel'].decode()[len(self.prefix):]
+        self.hub.deliver(channel, json.loads(event['data']))
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + channel, json.dumps(message))
+
+
+class Hub:
+    def __init__(self, backend=None, queue_size=100):
+        self.backend = backend or MemoryBackend()
+        self.queue_size = queue_size
+        self.subscribers = {}  # channel -> set of Subscription
+        self.lock = threading.Lock()
+        self.pid = None  # process the backend was started in
+
+    def start(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.backend.start(self)
+                    self.pid = os.getpid()
+
+    @classmethod
+    def from_url(cls, url=None):
+        if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+            return cls(RedisBackend(url))
+        return cls(MemoryBackend())
+
+    def subscribe(self, channel):
+        self.start()
+        subscription = Subscription(self, channel, self.queue_size)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+    def publish(self, channel, message):
+        """Sends a JSON-serializable message to every subscriber of ``channel``."""
+        self.start()
+        self.backend.publish(channel, message)
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
@@ -0,0 +1,107 @@
+"""Sends read-only requests to a replica database.
+
+Views opt in with ``ReplicaRouter.reads()``. While such a view runs, SELECTs
+issued through the session go to the ``replica`` bind; everything else
+(flushes, INSERT/UPDATE/DELETE, ``session.connection()`` without a
+statement) stays on the primary.
+
+A replica may lag behind the primary, so a client that just wrote is pinned
+to the primary for ``window`` seconds and sees its own writes. Only writes
+to ``tables`` (those the routed views read) count, so e.g. chat traffic
+does not mark catalog reads as stale. Clients are identified by a key the
+app chooses (the seller's userId here). The record of recent writes lives
+in the process, so with several workers a client is only pinned on the
+worker that handled its write; keep the window at least as long as the
+replication lag.
+"""
+import functools
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('db_replica'):
+            replica = self._db.engines.get('replica')
+            if (replica is not None and clause is not None and not self._flushing
+                    and not getattr(clause, 'is_dml', False)):
+                return replica
+        if self._flushing or getattr(clause, 'is_dml', False):
+            written = self.info.setdefault('wrote', set())
+            if getattr(clause, 'is_dml', False):
+                written.add(getattr(clause.table, 'name', None))
+            elif mapper is not None:
+                written.update(table.name for table in mapper.tables)
+            else:
+                written.add(None)  # Unknown; counts as touching every table.
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    def __init__(self, enabled=True, window=5.0, client_key=None, tables=None):
+        self.enabled = enabled
+        self.window = window
+        self.client_key = client_key or (lambda: None)
+        self.tables = set(tables) if tables is not None else None  # None: all
+        self.writes = {}  # client key -> monotonic time of its last write
+        self.last_write = float('-inf')
+        self.lock = threading.Lock()
+
+    def attach(self, session):
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+
+    def wrote(self, key):
+        now = time.monotonic()
+        with self.lock:
+            self.last_write = now
+            if key is not None:
+                self.writes[str(key)] = now
+            # Forget clients whose window has passed.
+            if len(self.writes) > 1024:
+                cutoff = now - self.window
+                self.writes = {k: t for k, t in self.writes.items() if t > cutoff}
+
+    def pinned(self, key):
+        """True while ``key`` is inside the window after its last write."""
+        if key is None:
+            return False
+        written = self.writes.get(str(key))
+        return written is not None and time.monotonic() - written < self.window
+
+    def settled(self):
+        """True when no write has committed in this process within the window."""
+        return time.monotonic() - self.last_write >= self.window
+
+    def stale(self):
+        """True when the current request read from a replica that may lag a recent write."""
+        return bool(g.get('db_replica')) and not self.settled()
+
+    def reads(self, methods=('GET', 'HEAD')):
+        """Routes the SELECTs of a view to the replica unless the client is pinned.
+
+        Only requests with one of ``methods`` are routed, so views that also
+        handle writes keep reading the rows they update from the primary.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                g.db_replica = (self.enabled and request.method in methods
+                                and not self.pinned(self.client_key()))
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _after_commit(self, session):
+        written = session.info.pop('wrote', None)
+        if not written:
+            return
+        if self.tables is None or None in written or written & self.tables:
+            self.wrote(self.client_key() if has_request_context() else None)
+
+    def _after_rollback(self, session):
+        session.info.pop('wrote', None)
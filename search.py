@@ -0,0 +1,490 @@
+"""Full-text product search and typeahead suggestions.
+
+Products are indexed over name, description and category. On SQLite builds
+with FTS5 the index is a virtual table living next to ``product`` and is
+written in the same transaction as the product row. Elsewhere a pure-Python
+inverted index is kept in memory and updated after each commit. Both support
+prefix matching of every query term and rank results with BM25.
+
+Typeahead completions come from ``Suggester``, a sorted in-memory array of
+product names and categories searched with bisect, so a keystroke never
+reaches the database.
+
+The in-memory structures only see commits made in their own process. With
+``refresh`` set, they check the table's row count, highest id and latest
+``updated_at`` at most that often and reload when another process changed
+them. The FTS5 index lives in the database and needs no reload.
+"""
+import bisect
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import column, event, inspect, text
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(value):
+    return TOKEN_RE.findall((value or '').lower())
+
+
+class TableVersion:
+    """Notices writes to ``table`` from other processes, polling every ``refresh`` s."""
+
+    def __init__(self, table, refresh=None, column='updated_at'):
+        self.refresh = refresh
+        self.sql = text('SELECT count(*), max(id), max({}) FROM {}'.format(column, table))
+        self.seen = None
+        self.checked = time.monotonic()
+        self.stale = False
+
+    def read(self, connection):
+        """Records the current version; call before loading the rows."""
+        self.seen = tuple(connection.execute(self.sql).one())
+        self.checked = time.monotonic()
+        self.stale = False
+
+    def due(self):
+        return self.stale or (self.refresh is not None
+                              and time.monotonic() - self.checked >= self.refresh)
+
+    def changed(self, connection):
+        """True once the table changed since ``read``, until the next ``read``."""
+        if not self.stale and self.due():
+            seen = self.seen
+            self.read(connection)
+            self.stale = self.seen != seen
+        return self.stale
+
+
+class InvertedIndex:
+    """In-memory BM25 index used when FTS5 is not available."""
+
+    transactional = False
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, table, fields, refresh=None):
+        self.table = table
+        self.fields = fields
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.version = TableVersion(table, refresh)
+        self.reset()
+
+    def reset(self):
+        self.postings = {}  # term -> {doc_id: term frequency}
+        self.doc_terms = {}  # doc_id -> Counter of its terms
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.vocabulary = []  # sorted terms, for prefix lookups
+
+    def ensure(self, connection, separate=True):
+        if self.loaded and not self.version.changed(connection):
+            return
+        with self.lock:
+            if self.loaded and not self.version.stale:
+                return
+            self.reset()
+            self.version.read(connection)
+            columns = ', '.join(self.fields)
+            rows = connection.execute(text(
+                'SELECT id, {} FROM {}'.format(columns, self.table)))
+            for row in rows:
+                self.upsert(connection, row[0], row[1:])
+            self.loaded = True
+
+    def upsert(self, connection, doc_id, values):
+        terms = Counter(t for value in values for t in tokenize(value))
+        with self.lock:
+            self._remove(doc_id)
+            self.doc_terms[doc_id] = terms
+            self.doc_lengths[doc_id] = sum(terms.values())
+            self.total_length += self.doc_lengths[doc_id]
+            for term, tf in terms.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = {}
+                    bisect.insort(self.vocabulary, term)
+                postings[doc_id] = tf
+
+    def upsert_many(self, connection, docs):
+        for doc_id, values in docs:
+            self.upsert(connection, doc_id, values)
+
+    def delete(self, connection, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in terms:
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+
+    def _expand(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + '\uffff', start)
+        return self.vocabulary[start:end]
+
+    def _scores(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+        n = len(self.doc_terms)
+        avg_length = self.total_length / n if n else 0
+        scores = None
+        for token in tokens:
+            token_scores = {}
+            for term in self._expand(token):
+                postings = self.postings[term]
+                idf = math.log((n - len(postings) + 0.5) / (len(postings) + 0.5) + 1)
+                for doc_id, tf in postings.items():
+                    length = self.doc_lengths[doc_id]
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    token_scores[doc_id] = token_scores.get(doc_id, 0) + \
+                        idf * tf * (self.k1 + 1) / norm
+            # Every query term has to match (AND), like FTS5.
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc_id: score + token_scores[doc_id]
+                          for doc_id, score in scores.items() if doc_id in token_scores}
+            if not scores:
+                break
+        return scores
+
+    def search(self, connection, query, limit, offset=0):
+        with self.lock:
+            scores = self._scores(query)
+        ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+        return ranked[offset:offset + limit]
+
+    def clause(self, id_column, query):
+        with self.lock:
+            return id_column.in_(list(self._scores(query)))
+
+
+class Fts5Index:
+    """SQLite FTS5 virtual table keyed by product id (the FTS rowid)."""
+
+    transactional = True
+
+    def __init__(self, table, fields):
+        self.table = table
+        self.fields = fields
+        self.fts_table = table + '_fts'
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    @staticmethod
+    def available(connection):
+        if connection.dialect.name != 'sqlite':
+            return False
+        options = connection.exec_driver_sql('PRAGMA compile_options').scalars()
+        return 'ENABLE_FTS5' in set(options)
+
+    def ensure(self, connection, separate=True):
+        """Creates the table and fills it from the products if out of step.
+
+        By default this runs and commits on its own connection: the caller's
+        transaction may be a read that is never committed, and a rebuild
+        inside it would be rolled back. ``separate=False`` builds in the
+        caller's write transaction instead and leaves ``loaded`` for the
+        caller to set once that commits.
+        """
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            if not separate:
+                self.build(connection)
+                return
+            with connection.engine.begin() as own:
+                self.build(own)
+            self.loaded = True
+
+    def build(self, connection):
+        columns = ', '.join(self.fields)
+        connection.exec_driver_sql(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5({})'.format(
+                self.fts_table, columns))
+        indexed = connection.exec_driver_sql(
+            'SELECT count(*) FROM {}'.format(self.fts_table)).scalar()
+        stored = connection.exec_driver_sql(
+            'SELECT count(*) FROM {}'.format(self.table)).scalar()
+        if indexed != stored:
+            self.rebuild(connection)
+
+    def rebuild(self, connection):
+        columns = ', '.join(self.fields)
+        connection.exec_driver_sql('DELETE FROM {}'.format(self.fts_table))
+        connection.exec_driver_sql(
+            'INSERT INTO {0}(rowid, {1}) SELECT id, {1} FROM {2}'.format(
+                self.fts_table, columns, self.table))
+
+    def upsert(self, connection, doc_id, values):
+        self.upsert_many(connection, [(doc_id, values)])
+
+    def upsert_many(self, connection, docs):
+        # executemany: one statement each for thousands of bulk-written rows.
+        connection.exec_driver_sql(
+            'DELETE FROM {} WHERE rowid = ?'.format(self.fts_table),
+            [(doc_id,) for doc_id, _ in docs])
+        connection.exec_driver_sql(
+            'INSERT INTO {}(rowid, {}) VALUES (?, {})'.format(
+                self.fts_table, ', '.join(self.fields), ', '.join('?' * len(self.fields))),
+            [(doc_id,) + tuple(values) for doc_id, values in docs])
+
+    def delete(self, connection, doc_id):
+        connection.exec_driver_sql(
+            'DELETE FROM {} WHERE rowid = ?'.format(self.fts_table), (doc_id,))
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every token so user input cannot use FTS5 query syntax, and
+        # make each one a prefix query.
+        return ' '.join('"{}"*'.format(token) for token in tokenize(query))
+
+    def search(self, connection, query, limit, offset=0):
+        match = self.match_expression(query)
+        if not match:
+            return []
+        return connection.execute(text(
+            'SELECT rowid FROM {0} WHERE {0} MATCH :match '
+            'ORDER BY bm25({0}) LIMIT :limit OFFSET :offset'.format(self.fts_table)),
+            {'match': match, 'limit': limit, 'offset': offset}).scalars().all()
+
+    def clause(self, id_column, query):
+        match = self.match_expression(query)
+        if not match:
+            return id_column.in_([])
+        matches = text('SELECT rowid FROM {0} WHERE {0} MATCH :match'.format(
+            self.fts_table)).bindparams(match=match).columns(column('rowid'))
+        return id_column.in_(matches)
+
+
+class ProductSearch:
+    """Keeps a search index in sync with a mapped model through session events."""
+
+    def __init__(self, model, fields=('name', 'description', 'category'), refresh=None):
+        self.model = model
+        self.fields = fields
+        self.refresh = refresh  # for the in-memory index only
+        self.backend = None
+        self.lock = threading.Lock()
+        # Notified with every committed batch of changes.
+        self.listeners = []
+
+    def attach(self, session):
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+
+    def get_backend(self, connection, separate=True):
+        if self.backend is None:
+            with self.lock:
+                if self.backend is None:
+                    table = self.model.__table__.name
+                    if Fts5Index.available(connection):
+                        self.backend = Fts5Index(table, self.fields)
+                    else:
+                        self.backend = InvertedIndex(table, self.fields, self.refresh)
+        self.backend.ensure(connection, separate)
+        return self.backend
+
+    def search(self, session, query, limit, offset=0):
+        connection = session.connection()
+        return self.get_backend(connection).search(connection, query, limit, offset)
+
+    def clause(self, session, query):
+        """SQL criterion matching the ids of every product that matches ``query``."""
+        backend = self.get_backend(session.connection())
+        return backend.clause(self.model.id, query)
+
+    def _changes(self, session):
+        for obj in session.new:
+            if isinstance(obj, self.model):
+                yield 'upsert', obj
+        for obj in session.dirty:
+            if isinstance(obj, self.model):
+                state = inspect(obj)
+                # Stock and price updates do not touch the index.
+                if any(state.attrs[f].history.has_changes() for f in self.fields):
+                    yield 'upsert', obj
+        for obj in session.deleted:
+            if isinstance(obj, self.model):
+                yield 'delete', obj
+
+    def _after_flush(self, session, flush_context):
+        changes = [(op, obj.id, tuple(getattr(obj, f) for f in self.fields))
+                   for op, obj in self._changes(session)]
+        self.record(session, changes)
+
+    def record_rows(self, session, rows):
+        """Indexes rows of (id, *fields) written with Core statements.
+
+        Bulk INSERT/UPDATE statements bypass the ORM flush, so their callers
+        report what they wrote here, before committing.
+        """
+        self.record(session, [('upsert', row[0], tuple(row[1:])) for row in rows])
+
+    def record(self, session, changes):
+        if not changes:
+            return
+        connection = session.connection()
+        # Already writing: build a missing index in this transaction rather
+        # than wait on a second connection for the lock this one holds.
+        if session.info.get('search_built'):
+            backend = self.backend
+        else:
+            backend = self.get_backend(connection, separate=False)
+        if backend.transactional:
+            if not backend.loaded:
+                session.info['search_built'] = True
+            self._apply(backend, connection, changes)
+        # In-memory structures only see what actually gets committed.
+        session.info.setdefault('search_changes', []).extend(changes)
+
+    def _after_commit(self, session):
+        if session.info.pop('search_built', False):
+            self.backend.loaded = True
+        changes = session.info.pop('search_changes', None)
+        if not changes:
+            return
+        if not self.backend.transactional:
+            self._apply(self.backend, None, changes)
+        named = [(op, doc_id, dict(zip(self.fields, values)))
+                 for op, doc_id, values in changes]
+        for listener in self.listeners:
+            listener.apply(named)
+
+    def _after_rollback(self, session):
+        session.info.pop('search_built', None)
+        session.info.pop('search_changes', None)
+
+    @staticmethod
+    def _apply(backend, connection, changes):
+        upserts = []
+        for op, doc_id, values in changes:
+            if op == 'upsert':
+                upserts.append((doc_id, values))
+            else:
+                if upserts:
+                    backend.upsert_many(connection, upserts)
+                    upserts = []
+                backend.delete(connection, doc_id)
+        if upserts:
+            backend.upsert_many(connection, upserts)
+
+
+class Suggester:
+    """Prefix completions over product names and categories.
+
+    Completion keys are kept in a sorted list and looked up with bisect. Each
+    name is also keyed from every later word ("apple" completes to "Red
+    Apple"). Keys are reference counted per product, so several sellers can
+    list the same name and renames or deletes only drop what they added.
+    """
+
+    # Upper bound of prefix matches looked at per query.
+    max_scan = 256
+
+    def __init__(self, table, fields=('name', 'category'), refresh=None):
+        self.table = table
+        self.fields = fields
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.version = TableVersion(table, refresh)
+        self.reset()
+
+    def reset(self):
+        self.keys = []  # sorted completion keys
+        self.entries = {}  # key -> Counter of (text, kind, whole) -> refcount
+        self.doc_values = {}  # doc_id -> {field: value} currently indexed
+
+    @staticmethod
+    def _keys(value):
+        tokens = tokenize(value)
+        for i in range(len(tokens)):
+            yield ' '.join(tokens[i:]), i == 0
+
+    def ensure(self, connection):
+        if self.loaded and not self.version.changed(connection):
+            return
+        with self.lock:
+            if self.loaded and not self.version.stale:
+                return
+            self.reset()
+            self.version.read(connection)
+            rows = connection.execute(text('SELECT id, {} FROM {}'.format(
+                ', '.join(self.fields), self.table)))
+            for row in rows:
+                self._add(row[0], dict(zip(self.fields, row[1:])))
+            self.loaded = True
+
+    def apply(self, changes):
+        with self.lock:
+            # Not loaded yet: the initial load will read the committed rows.
+            if not self.loaded:
+                return
+            for op, doc_id, values in changes:
+                self._remove(doc_id)
+                if op == 'upsert':
+                    self._add(doc_id, values)
+
+    def _add(self, doc_id, values):
+        values = {f: values.get(f) for f in self.fields}
+        self.doc_values[doc_id] = values
+        for kind, value in values.items():
+            for key, whole in self._keys(value):
+                entry = self.entries.get(key)
+                if entry is None:
+                    entry = self.entries[key] = Counter()
+                    bisect.insort(self.keys, key)
+                entry[(value, kind, whole)] += 1
+
+    def _remove(self, doc_id):
+        values = self.doc_values.pop(doc_id, None)
+        if values is None:
+            return
+        for kind, value in values.items():
+            for key, whole in self._keys(value):
+                entry = self.entries[key]
+                entry[(value, kind, whole)] -= 1
+                if entry[(value, kind, whole)] <= 0:
+                    del entry[(value, kind, whole)]
+                if not entry:
+                    del self.entries[key]
+                    del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def suggest(self, session, query, limit=10):
+        prefix = ' '.join(tokenize(query))
+        if not prefix:
+            return []
+        if not self.loaded or self.version.due():
+            self.ensure(session.connection())
+        with self.lock:
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + '\uffff', start)
+            matches = {}
+            for key in self.keys[start:min(end, start + self.max_scan)]:
+                for (value, kind, whole), count in self.entries[key].items():
+                    best = matches.get((value, kind))
+                    rank = (whole, count)
+                    if best is None or rank > best:
+                        matches[(value, kind)] = rank
+        # Whole-string matches first, then the most listed, then alphabetical.
+        ranked = sorted(matches.items(),
+                        key=lambda item: (not item[1][0], -item[1][1], item[0][0].lower()))
+        return [{'text': value, 'type': kind} for (value, kind), _ in ranked[:limit]]
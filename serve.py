@@ -0,0 +1,191 @@
+"""Production entry point for the API.
+
+``python app.py`` starts Flask's debug server: one process with the
+reloader and debugger, meant for development only. This script serves
+the same app with worker processes and a bounded number of request
+threads per worker:
+
+    python serve.py --workers 4 --threads 16                  # no extra packages
+    python serve.py --server gunicorn --workers 4 --threads 16
+    python serve.py --server asgi --workers 4 --threads 16    # uvicorn + a2wsgi
+
+``threaded`` is a wsgiref server whose connections are handled on a pool of
+``--threads`` threads, pre-forked ``--workers`` times over one listening
+socket. ``gunicorn`` uses gunicorn's gthread workers. ``asgi`` runs the app
+under uvicorn through a2wsgi, which also calls the WSGI app on a pool of
+``--threads`` threads while the event loop handles slow clients.
+
+Each request thread gets its own session and pooled connection, so a
+SQLite connection is never used by two threads at once. DB_POOL_SIZE
+defaults to --threads so no thread waits for a connection. An open chat
+stream keeps its thread, so leave room for them in --threads.
+
+With more than one worker, point CHAT_PUBSUB_URL and CATALOG_CACHE_URL at
+a Redis server. Otherwise chat pushes and cache invalidations only reach
+the worker that handled the write, and the other workers serve cached
+catalog pages and answer If-None-Match with 304 for up to
+CATALOG_CACHE_TTL seconds after it. Search suggestions (and the search index
+off SQLite) are kept in each worker and pick up other workers' products
+within SEARCH_REFRESH_SECONDS.
+
+benchmarks/serving.py compares these modes with the debug server.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+logger = logging.getLogger('serve')
+
+
+class PooledWSGIServer(WSGIServer):
+    """wsgiref server that handles each connection on a bounded thread pool."""
+
+    request_queue_size = 128
+
+    def __init__(self, address, threads):
+        super().__init__(address, QuietHandler)
+        self.threads = threads
+        self.pool = None
+
+    def process_request(self, request, client_address):
+        if self.pool is None:
+            # Created in the worker, after the fork.
+            self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix='http')
+        self.pool.submit(self.handle_connection, request, client_address)
+
+    def handle_connection(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def load_app(threads):
+    os.environ.setdefault('DB_POOL_SIZE', str(threads))
+    from app import app
+    return app
+
+
+def reset_connections():
+    """Drops pooled connections inherited from the parent process."""
+    from app import app, db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def fork_workers(workers, target):
+    children = set()
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                target()
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+
+
+def serve_threaded(args):
+    app = load_app(args.threads)
+    server = PooledWSGIServer((args.host, args.port), args.threads)
+    server.set_app(app)
+    logger.info('Serving on http://%s:%s with %s workers x %s threads',
+                args.host, args.port, args.workers, args.threads)
+
+    def run():
+        reset_connections()
+        server.serve_forever()
+
+    if args.workers == 1:
+        run()
+    else:
+        fork_workers(args.workers, run)
+
+
+def serve_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', '{}:{}'.format(args.host, args.port))
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True)
+            self.cfg.set('post_fork', lambda server, worker: reset_connections())
+
+        def load(self):
+            return load_app(args.threads)
+
+    Application().run()
+
+
+def asgi_app():
+    """uvicorn factory: the Flask app behind a2wsgi's sized thread pool."""
+    from a2wsgi import WSGIMiddleware
+    threads = int(os.environ.get('SERVE_THREADS', 16))
+    return WSGIMiddleware(load_app(threads), workers=threads)
+
+
+def serve_asgi(args):
+    import uvicorn
+    os.environ['SERVE_THREADS'] = str(args.threads)
+    uvicorn.run('serve:asgi_app', factory=True, host=args.host, port=args.port,
+                workers=args.workers, log_level='warning')
+
+
+SERVERS = {'threaded': serve_threaded, 'gunicorn': serve_gunicorn, 'asgi': serve_asgi}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the API in production.')
+    parser.add_argument('--server', choices=sorted(SERVERS), default='threaded')
+    parser.add_argument('--host', default=os.environ.get('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 1)),
+                        help='worker processes')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 16)),
+                        help='request threads per worker')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(name)s %(message)s')
+    logger.setLevel(logging.INFO)
+    if args.workers > 1 and not (os.environ.get('CHAT_PUBSUB_URL') and os.environ.get('CATALOG_CACHE_URL')):
+        logger.warning('Several workers without CHAT_PUBSUB_URL/CATALOG_CACHE_URL: chat pushes '
+                       'and cache invalidations stay within one worker; other workers may serve '
+                       'catalog data up to CATALOG_CACHE_TTL seconds old')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    SERVERS[args.server](args)
+
+
+if __name__ == '__main__':
+    main()
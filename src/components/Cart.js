@@ -31,6 +31,7 @@ const Cart = () => {
     console.log("inside");
     if (cartLocal.length > 0 && address && city && state && pincode) {
       const items = cartLocal.map((item) => ({
+        product_id: item.id,
         product_name: item.name,
         quantity: item.quantity,
       }));
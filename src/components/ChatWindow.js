@@ -12,8 +12,35 @@ const ChatWindow = () => {
 
   useEffect(() => {
     fetchChatConversations();
+
+    // New messages are pushed by the server instead of refetching the
+    // whole history; EventSource resumes from the last event id itself.
+    const source = new EventSource(`http://127.0.0.1:8000/chat/stream?sender_id=${senderId}`);
+    source.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      setChatConversations(conversations => addMessage(conversations, message));
+    };
+    return () => source.close();
   }, []);
 
+  const addMessage = (conversations, message) => {
+    const counterpartId = message.type === 'sent' ? message.receiver_id : message.sender_id;
+    const existing = conversations.find(conv => conv.receiver_id === counterpartId);
+    if (!existing) {
+      return [...conversations, {
+        receiver_id: counterpartId,
+        reciever_name: message.type === 'sent' ? message.reciever_name : message.firstName,
+        messages: [message]
+      }];
+    }
+    if (existing.messages.some(msg => msg.id === message.id)) {
+      return conversations;
+    }
+    return conversations.map(conv => conv === existing
+      ? { ...conv, messages: [...conv.messages, message] }
+      : conv);
+  };
+
   const fetchChatConversations = () => {
     axios.get(`http://127.0.0.1:8000/chat?sender_id=${senderId}`)
       .then(response => {
@@ -127,7 +154,6 @@ const ChatWindow = () => {
       .then(response => {
         console.log('Reply sent:', response.data);
         setMessageInput('');
-        fetchChatConversations();
       })
       .catch(error => {
         console.error('Error sending reply:', error);
@@ -0,0 +1,71 @@
+import base64
+import os
+
+import pytest
+from sqlalchemy import event, insert
+
+import app as app_module
+from app import db, Usernew, Product
+
+PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC')
+
+
+@pytest.fixture
+def store(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMAGE_STORE', str(tmp_path))
+    monkeypatch.setattr(app_module.image_variants, 'submit', lambda digest: None)
+    with app.app_context():
+        seller = Usernew(firstname='Seller', lastname='One', email='seller@example.com',
+                         mobile='1000000000', password='x', role='seller')
+        db.session.add(seller)
+        db.session.commit()
+        return tmp_path, seller.id
+
+
+def product(seller_id, image):
+    return {'userId': seller_id, 'category': 'Fruits', 'name': 'Apple', 'count': 1,
+            'description': 'd', 'price': 10, 'offer': 0, 'offerDuration': None,
+            'imageBinary': base64.b64encode(image).decode()}
+
+
+def stored_files(root):
+    return [name for _, _, names in os.walk(root) for name in names]
+
+
+def test_image_is_stored_with_the_product(client, store):
+    root, seller_id = store
+    response = client.post('/addproduct', json=product(seller_id, PNG))
+    assert response.status_code == 200
+    assert stored_files(root) == [app_module.imagestore.digest_of(PNG)]
+
+
+def test_oversized_image_is_rejected_unstored(app, client, store, monkeypatch):
+    root, seller_id = store
+    monkeypatch.setitem(app.config, 'MAX_IMAGE_BYTES', len(PNG) - 1)
+    response = client.post('/addproduct', json=product(seller_id, PNG))
+    assert response.status_code == 413
+    assert stored_files(root) == []
+    with app.app_context():
+        assert Product.query.count() == 0
+
+
+def test_concurrently_created_product_leaves_no_image(app, client, store):
+    root, seller_id = store
+
+    def create_first(session, flush_context, instances):
+        # Another request creates the same product between lookup and commit.
+        with db.engine.begin() as conn:
+            conn.execute(insert(Product).values(
+                name='Apple', category='Fruits', description='d', user_id=seller_id,
+                price=10.0, count=1))
+
+    with app.app_context():
+        event.listen(db.session, 'before_flush', create_first, once=True)
+        try:
+            response = client.post('/addproduct', json=product(seller_id, PNG))
+        finally:
+            if event.contains(db.session, 'before_flush', create_first):
+                event.remove(db.session, 'before_flush', create_first)
+    assert response.status_code == 409
+    assert stored_files(root) == []
@@ -0,0 +1,70 @@
+from sqlalchemy import event
+
+from app import db, Usernew, Product, catalog_cache
+
+
+def add_products(count):
+    sellers = Usernew.query.all()
+    if not sellers:
+        sellers = [Usernew(firstname='Seller', lastname=str(i), email='seller{}@example.com'.format(i),
+                           mobile=str(1000000000 + i), password='x', role='seller',
+                           premium=i % 2 == 0) for i in range(5)]
+        db.session.add_all(sellers)
+        db.session.flush()
+    start = Product.query.count()
+    db.session.add_all(Product(name='Product {}'.format(i), category='Fruits', description='d',
+                               user_id=sellers[i % len(sellers)].id, price=1.0, count=1)
+                       for i in range(start, start + count))
+    db.session.commit()
+
+
+def listing_statements(app, client):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    catalog_cache.clear()
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get('/addproduct?limit=500')
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert response.status_code == 200
+    return len(response.get_json()), statements
+
+
+def test_listing_runs_constant_number_of_statements(app, client):
+    with app.app_context():
+        add_products(20)
+    client.get('/addproduct')  # The first request also loads offer expirations.
+    rows, small = listing_statements(app, client)
+    assert rows == 20
+
+    with app.app_context():
+        add_products(180)
+    rows, large = listing_statements(app, client)
+    assert rows == 200
+
+    assert len(small) == len(large) == 1
+
+
+def test_listing_reports_seller_premium(app, client):
+    with app.app_context():
+        add_products(10)
+        premium = {product.id: db.session.get(Usernew, product.user_id).premium
+                   for product in Product.query.all()}
+    for product in client.get('/addproduct?limit=500').get_json():
+        assert product['is_premium_seller'] == premium[product['id']]
+        assert product['premium_seller'] == premium[product['id']]
+
+
+def test_paging_headers_are_exposed_to_browsers(app, client):
+    with app.app_context():
+        add_products(3)
+    response = client.get('/addproduct?limit=2', headers={'Origin': 'http://localhost:3000'})
+    assert response.headers['X-Next-After']
+    exposed = response.headers['Access-Control-Expose-Headers'].split(', ')
+    assert {'X-Next-After', 'X-Next-Offset', 'X-Next-Before', 'X-Next-Before-Id'} <= set(exposed)
@@ -0,0 +1,51 @@
+import threading
+
+from app import db, Usernew, Product
+
+WRITERS = 8
+OPERATIONS = 30
+
+
+def test_parallel_orders_and_messages_never_hit_a_locked_database(app):
+    with app.app_context():
+        users = [Usernew(firstname='User{}'.format(i), lastname='Writer',
+                         email='user{}@example.com'.format(i), mobile=str(1000000000 + i),
+                         password='x', role='seller') for i in range(WRITERS + 1)]
+        db.session.add_all(users)
+        db.session.flush()
+        products = [Product(name='Product {}'.format(i), category='Fruits', description='d',
+                            user_id=users[0].id, price=1.0, count=10 ** 6) for i in range(10)]
+        db.session.add_all(products)
+        db.session.commit()
+        user_ids = [user.id for user in users]
+        product_ids = [product.id for product in products]
+
+    bodies = []
+    lock = threading.Lock()
+    start = threading.Barrier(WRITERS)
+
+    def writer(index):
+        client = app.test_client()
+        start.wait()
+        for i in range(OPERATIONS):
+            if i % 2:
+                response = client.post('/chat', json={
+                    'sender_id': user_ids[index + 1], 'receiver_id': user_ids[0],
+                    'message': 'message {} from writer {}'.format(i, index)})
+            else:
+                response = client.post('/placeorder', json={
+                    'address': 'a', 'city': 'c', 'state': 's', 'pincode': '1',
+                    'items': [{'product_id': product_ids[(index + i) % 10], 'quantity': 1},
+                              {'product_id': product_ids[(index + i + 1) % 10], 'quantity': 1}]})
+            with lock:
+                bodies.append((response.status_code, response.get_data(as_text=True)))
+
+    threads = [threading.Thread(target=writer, args=(index,)) for index in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(bodies) == WRITERS * OPERATIONS
+    assert not [body for _, body in bodies if 'database is locked' in body]
+    assert all(status < 400 for status, _ in bodies)
@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy import select
+
+from app import db, Product, ChatMessage, OrderItem
+
+# The filters the routes run, each of which must be served by an index.
+ROUTE_FILTERS = {
+    'category': select(Product.id, Product.name).where(Product.category == 'Fruits'),
+    'user_id': select(Product.id, Product.name).where(Product.user_id == 1),
+    'user_id_name': select(Product.id).where(Product.user_id == 1, Product.name == 'Apples'),
+    'chat_thread': select(ChatMessage.id).where(db.or_(
+        db.and_(ChatMessage.sender_id == 1, ChatMessage.receiver_id == 2),
+        db.and_(ChatMessage.sender_id == 2, ChatMessage.receiver_id == 1),
+    )).order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()),
+    'chat_conversations': select(ChatMessage.id).where(db.or_(
+        ChatMessage.sender_id == 1, ChatMessage.receiver_id == 1)),
+    'chat_receiver': select(ChatMessage.id).where(ChatMessage.receiver_id == 1),
+    'order_items': select(OrderItem.id, OrderItem.product_name).where(OrderItem.order_id == 1),
+}
+
+
+@pytest.mark.parametrize('name', sorted(ROUTE_FILTERS))
+def test_route_filter_uses_index(app, name):
+    with app.app_context():
+        sql = str(ROUTE_FILTERS[name].compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = [row[3] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql))]
+    assert any('USING INDEX' in step or 'USING COVERING INDEX' in step for step in plan), plan
+    assert not any(step.startswith('SCAN') for step in plan), plan
@@ -0,0 +1,47 @@
+import threading
+
+from app import db, Usernew, Product
+
+STOCK = 50
+ORDERS = 80
+
+
+def test_parallel_orders_never_oversell(app):
+    with app.app_context():
+        seller = Usernew(firstname='Seller', lastname='One', email='seller@example.com',
+                         mobile='1000000000', password='x', role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        product = Product(name='Last items', category='Fruits', description='d',
+                          user_id=seller.id, price=1.0, count=STOCK)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    statuses = []
+    lock = threading.Lock()
+    start = threading.Barrier(16)
+
+    def buyer(orders):
+        client = app.test_client()
+        start.wait()
+        for _ in range(orders):
+            response = client.post('/placeorder', json={
+                'address': 'a', 'city': 'c', 'state': 's', 'pincode': '1',
+                'items': [{'product_id': product_id, 'quantity': 1}]})
+            # Unexpected errors come back as 200 {'Error': ...}; only an
+            # order id counts as a success.
+            placed = 'order_id' in (response.get_json() or {})
+            with lock:
+                statuses.append('placed' if placed else response.status_code)
+
+    threads = [threading.Thread(target=buyer, args=(ORDERS // 16,)) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses.count('placed') == STOCK
+    assert statuses.count(409) == ORDERS - STOCK
+    with app.app_context():
+        assert db.session.get(Product, product_id).count == 0
@@ -0,0 +1,32 @@
+from app import db, Usernew, Product, product_search
+
+
+def test_index_built_from_rows_written_outside_the_orm(app, client):
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(Usernew.__table__.insert(), [dict(
+                id=1, firstname='Seller', lastname='One', email='seller@example.com',
+                mobile='1000000000', password='x', role='seller')])
+            connection.execute(Product.__table__.insert(), [dict(
+                name='Apple {}'.format(i), category='Fruits', description='Red apple',
+                count=1, price=1.0, discounted_price=0.0, hasDiscount=False, user_id=1,
+                seller_premium=False) for i in range(5)])
+    # As in a freshly started process.
+    product_search.backend = None
+
+    for _ in range(2):
+        assert len(client.get('/search?q=apple').get_json()) == 5
+    assert len(client.get('/addproduct?searchValue=apple').get_json()) == 5
+
+
+def test_blank_search_value_lists_everything(app, client):
+    with app.app_context():
+        seller = Usernew(firstname='Seller', lastname='One', email='seller@example.com',
+                         mobile='1000000000', password='x', role='seller')
+        db.session.add(seller)
+        db.session.flush()
+        db.session.add_all(Product(name='Product {}'.format(i), category='Fruits', description='d',
+                                   user_id=seller.id, price=1.0, count=1) for i in range(3))
+        db.session.commit()
+    for value in ('', '   '):
+        assert len(client.get('/addproduct', query_string={'searchValue': value}).get_json()) == 3